@@ -1,13 +1,22 @@
 from datetime import datetime, timedelta
-from os import path, listdir, mkdir
+from os import path, listdir, mkdir, environ
 import sys
-from glob import glob
 import pickle
 import streamlit as st
 from stellar_api import StellarCyberAPI
-from stellar_plots import StellarCyberPlots
+from query_cache import QueryCache
+from stats.bucket_store import DailyBucketStore
 from report_pages import *
-from report import REPORT_DIR, REPORT_TEMPLATE_DIR, run_report
+from report_catalog import ReportCatalog
+from report import REPORT_DIR, REPORT_TEMPLATE_DIR
+from report_jobs import JobQueue, JobWorkerPool
+from shared_reports import SharedReportCache
+from render_worker import RenderClient, parse_address
+from svg_optimize import SvgOptimizer
+
+CATALOG_PAGE_SIZE = 20
+JOB_POLL_SECONDS = 2
+LIVE_POLL_SECONDS = 1
 
 
 def load_config():
@@ -18,11 +27,50 @@ def load_config():
             st.session_state[var] = conf_dict[var]
 
 
-def load_saved_data(saved_stats_file):
-    with open(saved_stats_file, "rb") as f:
-        sc_stats = pickle.load(f)
-    st.session_state.sc_stats = sc_stats
-    st.session_state.sc_plots = StellarCyberPlots(sc_stats)
+@st.cache_resource
+def shared_reports():
+    """ One SharedReportCache for every session of this server process """
+    return SharedReportCache()
+
+
+@st.cache_resource
+def job_queue():
+    return JobQueue()
+
+
+@st.cache_resource
+def job_pool():
+    """ Background report runs for every session, sized by REPORT_JOB_WORKERS """
+    # Rendering goes to a warm render_worker.py when RENDER_WORKER=host:port is set
+    render_client = RenderClient(address=parse_address(environ["RENDER_WORKER"])) if environ.get("RENDER_WORKER") else None
+    # OPTIMIZE_SVG=1 minifies the exported figures, MEASURE_SVG_RENDER=1 also logs the render time that saves
+    measure_render = environ.get("MEASURE_SVG_RENDER") == "1"
+    optimizer = SvgOptimizer(measure_render=measure_render) if environ.get("OPTIMIZE_SVG") == "1" or measure_render else None
+    # Collectors run concurrently so watched jobs fill in their pages sooner
+    return JobWorkerPool(job_queue(), get_config_directory(), size=int(environ.get("REPORT_JOB_WORKERS", 2)),
+                         report_options={'render_client': render_client, 'parallel': True, 'optimizer': optimizer}).start()
+
+
+@st.cache_resource
+def report_catalog():
+    """ The catalog, brought up to date with the reports folder once per server process """
+    catalog = ReportCatalog(REPORT_DIR)
+    catalog.import_existing()
+    catalog.prune_missing()
+    return catalog
+
+
+def load_saved_data(report_dir):
+    """ Points the session at the shared copy of a report, False if its folder is gone """
+    try:
+        report = shared_reports().get(report_dir)
+    except FileNotFoundError:
+        st.error(f"Report folder {path.basename(report_dir)} no longer exists")
+        return False
+    # Sessions only reference the shared copy, they must not modify it
+    st.session_state.sc_stats = report.sc_stats
+    st.session_state.sc_plots = report.sc_plots
+    return True
 
 
 def show_status_caption():
@@ -44,7 +92,9 @@ def save_config():
         url=stss.host,
         username=stss.user,
         api_key=stss.api_key,
-        deployment=stss.deployment_type
+        deployment=stss.deployment_type,
+        cache=QueryCache(),
+        bucket_store=DailyBucketStore()
     )
     stss['last_config'] = file_name
 
@@ -142,12 +192,49 @@ def show_query_form():
     template_files = [f for f in listdir(REPORT_TEMPLATE_DIR) if f.endswith(".html.template")]
     selected_template = st.selectbox("HTML Template", template_files)
 
-    if st.button(f"Run Report{'s' if len(tenants) > 1 else ''}"):
-        for tenant in tenants:
-            with st.spinner(f"Retrieving Data for {tenant}"):
-                sc_stats, sc_plots = run_report(st.session_state.api, tenant, str(timeframe[0]), str(timeframe[1]), template=selected_template)
-                st.session_state.sc_stats = sc_stats
-                st.session_state.sc_plots = sc_plots
+    if st.button(f"Queue Report{'s' if len(tenants) > 1 else ''}", disabled=not tenants):
+        if not st.session_state.get('last_config'):
+            st.error("Save the configuration before queueing reports")
+        else:
+            if len(tenants) > 1:
+                # Fetched with one tenant split query per collector and rendered as one batch
+                job_queue().submit_batch(st.session_state.last_config, tenants, str(timeframe[0]), str(timeframe[1]), template=selected_template)
+            else:
+                job_queue().submit(st.session_state.last_config, tenants[0], str(timeframe[0]), str(timeframe[1]), template=selected_template)
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_jobs():
+    jobs = job_queue().jobs()
+    if not jobs:
+        st.caption("No report jobs")
+        return
+    for job in jobs:
+        label = f"{job['tenant']} {job['start']} - {job['end']}: {job['message']}"
+        if job['status'] in ('queued', 'running'):
+            st.progress(job['progress'] or 0.0, text=label)
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Cancel", key=f"cancel_job_{job['id']}"):
+                    job_queue().cancel(job['id'])
+            with col2:
+                live = job_pool().live.get(job['id'])
+                if live is not None and st.button("Watch", key=f"watch_job_{job['id']}"):
+                    # The pages fill in as the job's collectors finish
+                    st.session_state.pop('sc_stats', None)
+                    st.session_state.pop('sc_plots', None)
+                    st.session_state.live_report = live
+                    st.rerun()
+        elif job['status'] == 'done':
+            st.caption(f":white_check_mark: {label}")
+            if st.button("Open", key=f"open_job_{job['id']}"):
+                st.session_state.pop('live_report', None)
+                if load_saved_data(job['report_dir']):
+                    st.rerun()
+        else:
+            st.caption(f":x: {label}" + (f" ({job['error']})" if job['error'] else ""))
+    if st.button("Clear Finished Jobs"):
+        job_queue().clear_finished()
 
 
 def show_sidebar():
@@ -157,33 +244,74 @@ def show_sidebar():
         show_config_form()
     if 'api' in st.session_state:
         show_query_form()
+
+    st.subheader("Report Jobs", divider="green")
+    show_jobs()
     
     st.subheader("Open Existing Report", divider="green")
 
-    pdf_files = list(glob(REPORT_DIR + "/*/*.pdf", recursive=True))
-    folder_file_map = {f.split("/")[-2]: f for f in pdf_files}
-
-    selected_folder = st.selectbox(f"{len(pdf_files)} Reports Generated", folder_file_map.keys())
-    if selected_folder:
-        load_saved_data(path.join(REPORT_DIR, selected_folder, ".saved"))
-
-        with open(folder_file_map[selected_folder], "rb") as file:
+    catalog = report_catalog()
+
+    tenant_filter = st.selectbox("Tenant", ["All Tenants"] + catalog.tenants())
+    tenant_filter = None if tenant_filter == "All Tenants" else tenant_filter
+    text_filter = st.text_input("Search")
+
+    total = catalog.count(tenant_filter, text_filter)
+    pages = max(1, -(-total // CATALOG_PAGE_SIZE))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+    reports = catalog.search(tenant_filter, text_filter, limit=CATALOG_PAGE_SIZE, offset=(page - 1) * CATALOG_PAGE_SIZE)
+
+    labels = {
+        r['pdf_path']: f"{r['tenant']} {r['start']} - {r['end']}" + (f" ({r['template']})" if r['template'] else "")
+        for r in reports
+    }
+    selected_pdf = st.selectbox(f"{total} Reports Generated", labels.keys(), format_func=labels.get)
+
+    selected = next((r for r in reports if r['pdf_path'] == selected_pdf), None)
+    if selected and selected['critical_incidents'] is not None:
+        st.caption(f"{selected['critical_incidents']} critical cases, {selected['critical_alerts']} critical alerts, "
+                   f"{selected['distinct_data_sources']} data sources")
+
+    # Only read a report's stats when it's explicitly opened
+    if selected and st.button("Open Report"):
+        st.session_state.pop('live_report', None)
+        if load_saved_data(catalog.full_path(selected['report_dir'])):
+            st.session_state.opened_pdf = selected_pdf
+        else:
+            # Deleted since the catalog was loaded
+            catalog.remove(selected_pdf)
+
+    opened_pdf = st.session_state.get('opened_pdf')
+    if opened_pdf and path.exists(catalog.full_path(opened_pdf)):
+        with open(catalog.full_path(opened_pdf), "rb") as file:
             btn = st.download_button(
                     label="Download PDF",
                     data=file,
-                    file_name=f"{selected_folder}.pdf",
+                    file_name=f"{path.dirname(opened_pdf)}.pdf",
                     mime="application/pdf"
                   )
 
 
-def run_app():
+def sync_live_report():
+    """ Points the session at a watched job's stats as they come in, True while that job is still running """
+    live = st.session_state.get('live_report')
+    if live is None:
+        return False
+    if live.sc_stats is not None:
+        st.session_state.sc_stats = live.sc_stats
+        st.session_state.sc_plots = live.sc_plots
+    if not live.done:
+        return True
+    del st.session_state.live_report
+    if live.fraction() < 1:
+        # The job failed or was cancelled, its stats are incomplete
+        st.session_state.pop('sc_stats', None)
+        st.session_state.pop('sc_plots', None)
+    return False
 
-    st.set_page_config(
-        page_title="Stellar Cyber Executive Reporting App", layout="wide", initial_sidebar_state="expanded"
-    )
 
-    with st.sidebar:
-        show_sidebar()
+def show_report(polling=False):
+    watching = sync_live_report()
 
     st.header('Stellar Cyber Executive Report', divider="blue")
     show_status_caption()
@@ -203,6 +331,28 @@ def run_app():
     with tab5:
         show_visibility()
 
+    if polling and not watching:
+        # The watched job finished, a full rerun stops polling and refreshes the sidebar
+        st.rerun()
+
+
+def run_app():
+
+    st.set_page_config(
+        page_title="Stellar Cyber Executive Reporting App", layout="wide", initial_sidebar_state="expanded"
+    )
+    # Picks up jobs queued before a restart
+    job_pool()
+
+    with st.sidebar:
+        show_sidebar()
+
+    if st.session_state.get('live_report') is not None:
+        # Redrawn every second while the watched job's collectors come in
+        st.fragment(show_report, run_every=LIVE_POLL_SECONDS)(polling=True)
+    else:
+        show_report()
+
 
 if __name__ == '__main__':
     run_app()
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from utils import atomic_write
+
+
+CACHE_DIR = __file__.replace("query_cache.py", ".cache")
+
+# Disk space the query cache may use, QUERY_CACHE_MB overrides it
+DEFAULT_MAX_DISK_BYTES = int(os.environ.get("QUERY_CACHE_MB", 512)) * 1024 * 1024
+# Entries not read or written for this long are pruned even if their range is in the past
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+PRUNE_EVERY_PUTS = 200
+
+
+def query_range_end(query):
+    """
+    Latest end of the time range a query or REST params cover, as a date.
+    Looks at ES range filters (lte/lt) and TO~created_at REST params. None if unbounded.
+    """
+    ends = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            for k, v in node.items():
+                if k == 'range' and isinstance(v, dict):
+                    for bounds in v.values():
+                        for op in ('lte', 'lt'):
+                            if isinstance(bounds, dict) and op in bounds:
+                                ends.append(datetime.fromisoformat(str(bounds[op])[0:10]).date())
+                elif k == 'TO~created_at':
+                    ends.append(datetime.fromtimestamp(int(v) / 1000, tz=timezone.utc).date())
+                else:
+                    walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+
+    try:
+        walk(query)
+    except (TypeError, ValueError):
+        return None
+    return max(ends) if ends else None
+
+
+def prune_cache_dir(cache_dir, max_bytes, max_age):
+    """
+    Removes files of cache_dir unused (by mtime) for max_age seconds, then the least recently
+    used ones until the rest fit in max_bytes. Returns (files removed, bytes left).
+    """
+    files = []
+    for dir_path, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            files.append((file_stat.st_mtime, file_stat.st_size, file_path))
+
+    files.sort()
+    now = time.time()
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, file_path in files:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed, total
+
+
+def cacheable(result):
+    """ False for empty results and error responses that came back with a 200 """
+    if not result:
+        return False
+    if isinstance(result, dict):
+        if result.get('error') or result.get('errors'):
+            return False
+        # Partial ES results would be served as complete ones
+        if result.get('timed_out') or (result.get('_shards') or {}).get('failed'):
+            return False
+    return True
+
+
+class QueryCache():
+    """
+    Two tier cache for Stellar Cyber query results: a bounded in-memory LRU
+    in front of a persistent on-disk store, keyed by a canonical hash of the request.
+    Results for ranges entirely in the past don't expire, anything touching today
+    (or without a range) is kept for recent_ttl seconds. The disk tier is pruned of
+    entries unused for max_age seconds, then least recently used ones down to max_disk_bytes.
+    """
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "queries"), max_entries=256, recent_ttl=300,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.recent_ttl = recent_ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.puts = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.prune()
+
+    def __getstate__(self):
+        # Locks can't be pickled and the memory tier isn't worth persisting
+        state = self.__dict__.copy()
+        del state['lock']
+        state['memory'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[0:2], f"{key}.json")
+
+    def expires_at(self, query):
+        end = query_range_end(query)
+        today = min(datetime.now().date(), datetime.now(timezone.utc).date())
+        if end is not None and end < today:
+            return None
+        return time.time() + self.recent_ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+
+        if entry is None:
+            try:
+                with open(self.path(key), "r") as f:
+                    entry = json.load(f)
+                # The file's mtime is its last use for pruning
+                os.utime(self.path(key))
+            except (OSError, ValueError):
+                return None
+
+        if entry['expires_at'] is not None and entry['expires_at'] < time.time():
+            self.discard(key)
+            return None
+
+        self.remember(key, entry)
+        return entry['result']
+
+    def put(self, key, result, query):
+        if not cacheable(result):
+            return
+        entry = {'expires_at': self.expires_at(query), 'result': result}
+        self.remember(key, entry)
+
+        file_path = self.path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        atomic_write(file_path, json.dumps(entry))
+
+        with self.lock:
+            self.puts += 1
+            due = self.puts % PRUNE_EVERY_PUTS == 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        """ Removes disk entries unused for max_age, then the least recently used until within max_disk_bytes """
+        removed, total = prune_cache_dir(self.cache_dir, self.max_disk_bytes, self.max_age)
+        if removed:
+            print(f"Pruned {removed} query cache entries, {total / 1024 / 1024:.1f} MB left")
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
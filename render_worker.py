@@ -0,0 +1,186 @@
+import argparse
+import ipaddress
+import os
+import secrets
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+from query_cache import CACHE_DIR
+from report import TEMPLATES, load_report_stats, report_paths, render_report
+from stellar_export import FigureCache, warm_renderer
+from svg_optimize import SvgOptimizer
+
+RENDER_WORKER_ADDRESS = ('127.0.0.1', 6150)
+# Used when RENDER_WORKER_AUTHKEY isn't set: generated by the worker, readable by its user only
+RENDER_WORKER_AUTHKEY_FILE = os.path.join(CACHE_DIR, "render_worker.key")
+
+# Static report assets worth keeping in memory between jobs
+CACHED_ASSET_EXTENSIONS = ('.ttf', '.otf', '.woff', '.woff2', '.css', '.jpg', '.jpeg', '.png')
+
+
+def load_authkey(create=False):
+    """
+    Key the worker and its clients authenticate with: RENDER_WORKER_AUTHKEY, otherwise the key file.
+    With create the worker generates a random key file when there is none.
+    """
+    if os.environ.get("RENDER_WORKER_AUTHKEY"):
+        return os.environ["RENDER_WORKER_AUTHKEY"].encode("utf-8")
+    if not os.path.exists(RENDER_WORKER_AUTHKEY_FILE):
+        if not create:
+            raise RuntimeError(f"No render worker authkey: set RENDER_WORKER_AUTHKEY or start render_worker.py to create {RENDER_WORKER_AUTHKEY_FILE}")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        try:
+            fd = os.open(RENDER_WORKER_AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+    # Jobs are unpickled, a key others can read would let them run code in the worker
+    os.chmod(RENDER_WORKER_AUTHKEY_FILE, 0o600)
+    with open(RENDER_WORKER_AUTHKEY_FILE, "r") as f:
+        return f.read().strip().encode("utf-8")
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+class CachingURLFetcher():
+    """
+    weasyprint url_fetcher keeping fonts, images and CSS in memory.
+    Report folders hold copies of the same template assets, so entries are keyed
+    by file name, size and mtime rather than by URL.
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    def __call__(self, url):
+        if not url.startswith("file://") or not url.lower().endswith(CACHED_ASSET_EXTENSIONS):
+            return weasyprint.default_url_fetcher(url)
+
+        try:
+            file_stat = os.stat(url2pathname(urlparse(url).path))
+            key = (os.path.basename(url), file_stat.st_size, file_stat.st_mtime_ns)
+        except OSError:
+            return weasyprint.default_url_fetcher(url)
+
+        if key not in self.cache:
+            result = weasyprint.default_url_fetcher(url)
+            if 'file_obj' in result:
+                with result.pop('file_obj') as f:
+                    result['string'] = f.read()
+            self.cache[key] = result
+        # Relative URLs inside a cached stylesheet must resolve against this report's folder
+        return dict(self.cache[key], redirected_url=url)
+
+
+class RenderWorker():
+    """
+    Long lived process rendering already fetched reports. WeasyPrint, plotly and kaleido
+    are imported and started once, fonts, assets and the jinja environment stay warm between jobs.
+    """
+
+    def __init__(self, address=RENDER_WORKER_ADDRESS, authkey=None):
+        self.address = address
+        self.authkey = authkey or load_authkey(create=True)
+        TEMPLATES.precompile()
+        self.font_config = FontConfiguration()
+        self.url_fetcher = CachingURLFetcher()
+        self.figure_cache = FigureCache()
+        warm_renderer()
+
+    def render(self, job):
+        paths = report_paths(job['tenant'], job['start'], job['end'])
+        sc_stats = load_report_stats(paths['report_dir'])
+
+        render_report(sc_stats, job['tenant'], job['start'], job['end'],
+                      template=job.get('template', 'report.html.template'),
+                      renderer=job.get('renderer', 'plotly'),
+                      figure_cache=self.figure_cache,
+                      font_config=self.font_config,
+                      url_fetcher=self.url_fetcher,
+                      section_workers=job.get('section_workers', 0),
+                      templates=job.get('templates'),
+                      formats=job.get('formats') or ('pdf',),
+                      optimizer=SvgOptimizer(**job['optimize']) if job.get('optimize') else None)
+        return paths['pdf_filename']
+
+    def serve(self):
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"Render worker listening on {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    # A client with the wrong key or one that hung up mustn't stop the worker
+                    print("Rejected render worker connection:", repr(e))
+                    continue
+                with conn:
+                    try:
+                        job = conn.recv()
+                    except (EOFError, OSError) as e:
+                        print("Render worker connection dropped:", repr(e))
+                        continue
+                    started = time.perf_counter()
+                    try:
+                        pdf_filename = self.render(job)
+                        reply = {'ok': True, 'pdf_filename': pdf_filename}
+                    except Exception as e:
+                        print(traceback.format_exc())
+                        reply = {'ok': False, 'error': repr(e)}
+                    reply['seconds'] = time.perf_counter() - started
+                    print(f"Rendered {job.get('tenant')} in {reply['seconds']:.2f}s")
+                    try:
+                        conn.send(reply)
+                    except OSError as e:
+                        print("Render worker connection dropped:", repr(e))
+
+
+class RenderClient():
+    """ Submits render jobs for reports whose stats run_report already saved """
+
+    def __init__(self, address=RENDER_WORKER_ADDRESS, authkey=None):
+        self.address = address
+        self.authkey = authkey
+
+    def render(self, tenant, start, end, template='report.html.template', renderer='plotly', section_workers=0, optimize=None,
+               templates=None, formats=('pdf',)):
+        """ optimize holds SvgOptimizer arguments, None leaves the exported SVGs as they are """
+        with Client(self.address, authkey=self.authkey or load_authkey()) as conn:
+            conn.send({'tenant': tenant, 'start': start, 'end': end, 'template': template, 'renderer': renderer,
+                       'section_workers': section_workers, 'optimize': optimize,
+                       'templates': templates, 'formats': list(formats)})
+            reply = conn.recv()
+        if not reply['ok']:
+            raise RuntimeError(f"Render worker failed for {tenant}: {reply['error']}")
+        return reply['pdf_filename']
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return (host or RENDER_WORKER_ADDRESS[0], int(port))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='RenderWorker',
+        description='Keep a warm report renderer running for run_report to submit jobs to'
+    )
+    parser.add_argument('--address', default=f"{RENDER_WORKER_ADDRESS[0]}:{RENDER_WORKER_ADDRESS[1]}", help='host:port to listen on')
+    parser.add_argument('--allow-remote', action='store_true', help='Allow --address to be a non loopback interface')
+    args = parser.parse_args()
+
+    address = parse_address(args.address)
+    if not is_loopback(address[0]) and not args.allow_remote:
+        parser.error(f"Refusing to listen on {address[0]} without --allow-remote, jobs are unpickled")
+
+    RenderWorker(address=address).serve()
@@ -1,27 +1,81 @@
 import argparse
 import jinja2
 from numerize import numerize
-from os import path, mkdir
+from os import path, mkdir, makedirs, listdir
 import pickle
-from shutil import copytree
 import weasyprint
 from stellar_api import StellarCyberAPI
+from query_cache import QueryCache, CACHE_DIR
+from stats.bucket_store import DailyBucketStore
+from stats.incident_stats import CASES_MAX_IN_FLIGHT
 from stellar_stats import StellarCyberStats
-from stellar_plots import StellarCyberPlots
+from stats_store import StatsStore
+from stellar_plots import StellarCyberPlots, save_figures_many
+from stellar_export import FigureExporter, FigureCache
+from report_assets import link_assets
+from report_catalog import ReportCatalog
+from report_formats import OUTPUT_FORMATS, write_standalone_html, write_stats_json
+from report_sections import PDF_OPTIONS, write_pdf_sections
+from svg_optimize import SvgOptimizer
 from utils import humansize
 
 
 REPORT_TEMPLATE_DIR = __file__.replace("report.py", "report_template")
 REPORT_DIR = __file__.replace("report.py", "reports_generated")
+ASSET_STORE_DIR = path.join(REPORT_DIR, ".assets")
 
 
-def get_report_html(template_dir, sc_stats, customer_name, start_date, end_date, template='report.html.template'):
-    categories_sorted, data_sources_sorted, volume_sorted = sc_stats.combine_data_sources()
+class TemplateRegistry():
+    """
+    Jinja environment shared by every report rendered in the process. Templates are compiled
+    once (and the bytecode kept on disk between processes), then only re-read when they change.
+    """
+
+    def __init__(self, template_dir=REPORT_TEMPLATE_DIR, bytecode_dir=path.join(CACHE_DIR, "jinja")):
+        makedirs(bytecode_dir, exist_ok=True)
+        self.template_dir = template_dir
+        self.env = jinja2.Environment(
+            loader = jinja2.FileSystemLoader(template_dir),
+            bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_dir),
+            trim_blocks = True
+        )
+
+    def template_names(self):
+        return sorted(f for f in listdir(self.template_dir) if f.endswith(".html.template"))
+
+    def precompile(self):
+        for name in self.template_names():
+            self.env.get_template(name)
+
+    def render(self, template, **context):
+        return self.env.get_template(template).render(**context)
+
+    def render_many(self, template, contexts):
+        """ Renders one template for several contexts, compiling it once """
+        report_template = self.env.get_template(template)
+        return [report_template.render(**context) for context in contexts]
+
+
+TEMPLATES = TemplateRegistry()
+
+
+def get_report_html(template_dir, sc_stats, customer_name, start_date, end_date, template='report.html.template', j2_env=None):
+    if j2_env is None:
+        j2_env = TEMPLATES.env if template_dir == REPORT_TEMPLATE_DIR else jinja2.Environment(loader = jinja2.FileSystemLoader(template_dir), trim_blocks = True)
+    return j2_env.get_template(template).render(**get_report_context(sc_stats, customer_name, start_date, end_date))
 
-    j2_env = jinja2.Environment(loader = jinja2.FileSystemLoader(template_dir), trim_blocks = True)
-    report_template = j2_env.get_template(template)
 
-    report_html = report_template.render(
+def get_reports_html(stats_by_customer, start_date, end_date, template='report.html.template'):
+    """ HTML for many reports with one compiled template, {customer name: sc_stats} -> {customer name: html} """
+    names = list(stats_by_customer)
+    contexts = [get_report_context(stats_by_customer[name], name, start_date, end_date) for name in names]
+    return dict(zip(names, TEMPLATES.render_many(template, contexts)))
+
+
+def get_report_context(sc_stats, customer_name, start_date, end_date):
+    categories_sorted, data_sources_sorted, volume_sorted = sc_stats.combine_data_sources()
+
+    return dict(
         customer_name = customer_name,
         start_date = start_date,
         end_date = end_date,
@@ -44,53 +98,214 @@ def get_report_html(template_dir, sc_stats, customer_name, start_date, end_date,
         top_assets = sc_stats.top_assets_stats['top_5_assets'],
         top_incidents = sc_stats.incident_stats['top_3_incidents']
     )
-    return report_html
 
 
-def run_report(api, tenant, start, end, template='report.html.template'):
+def report_paths(tenant, start, end, template='report.html.template'):
+    """ Locations of everything a report run writes, outputs of other templates than the default get its name """
     report_dir = path.join(REPORT_DIR, f"{tenant}_{start.replace('-','')}-{end.replace('-','')}")
     template_dir = path.join(report_dir, "report_template")
-    plots_dir = path.join(template_dir, "plots")
-    html_filename = path.join(template_dir, "report.html")
-    saved_stats_filename = path.join(report_dir, ".saved")
-    pdf_filename = path.join(report_dir, f"{tenant} Executive Report.pdf")
+    suffix = "" if template == 'report.html.template' else f" - {template.replace('.html.template', '')}"
+    return {
+        'report_dir': report_dir,
+        'template_dir': template_dir,
+        'plots_dir': path.join(template_dir, "plots"),
+        'html_filename': path.join(template_dir, f"report{suffix}.html"),
+        'stats_dir': path.join(report_dir, "stats"),
+        'saved_stats_filename': path.join(report_dir, ".saved"),  # Pickled stats of reports made before stats_dir
+        'pdf_filename': path.join(report_dir, f"{tenant} Executive Report{suffix}.pdf"),
+        'standalone_html_filename': path.join(report_dir, f"{tenant} Executive Report{suffix}.html"),
+        'json_filename': path.join(report_dir, "stats.json"),
+    }
+
+
+def fetch_report_data(api, tenant, start, end, parallel=False, max_workers=4, fused=False, sc_stats=None, on_result=None, should_stop=None,
+                      cases_in_flight=CASES_MAX_IN_FLIGHT):
+    """
+    Queries the stats for a report and saves them (Arrow/Parquet, see stats_store) with the critical incidents CSV into its folder.
+    on_result is handed to StellarCyberStats to publish each collector's result as it finishes,
+    should_stop to skip the remaining collectors; stopped stats aren't saved.
+    """
+    paths = report_paths(tenant, start, end)
 
     if not path.exists(REPORT_DIR):
         mkdir(REPORT_DIR)
 
-    if not path.exists(report_dir):
-        mkdir(report_dir)
-        copytree(REPORT_TEMPLATE_DIR, template_dir)
+    if not path.exists(paths['report_dir']):
+        mkdir(paths['report_dir'])
+    # Fonts, cover images and CSS are hard links into the shared versioned asset store
+    link_assets(paths['template_dir'], REPORT_TEMPLATE_DIR, ASSET_STORE_DIR)
 
-    sc_stats = StellarCyberStats(api, tenant, start, end, "")
+    if sc_stats is None:
+        sc_stats = StellarCyberStats(api, tenant, start, end, "", parallel=parallel, max_workers=max_workers, fused=fused, on_result=on_result,
+                                     should_stop=should_stop, cases_in_flight=cases_in_flight)
+    if getattr(sc_stats, 'stopped', False):
+        return sc_stats
 
     df = sc_stats.incident_stats['incidents_df']
-    df[df.Is_Critical == True].to_csv(path.join(report_dir, "critical_incidents.csv"))
+    df[df.Is_Critical == True].to_csv(path.join(paths['report_dir'], "critical_incidents.csv"))
 
-    with open(saved_stats_filename, "wb") as f:
-        pickle.dump(sc_stats, f)
+    sc_stats.save(paths['stats_dir'])
 
-    sc_plots = StellarCyberPlots(sc_stats)
-    sc_plots.save_figures(plots_dir)
+    return sc_stats
+
+
+def load_report_stats(report_dir):
+    """ Saved stats of a report folder, lazily loaded, or unpickled for reports made before stats_dir """
+    stats_dir = path.join(report_dir, "stats")
+    if StatsStore.exists(stats_dir):
+        return StellarCyberStats.load(stats_dir)
+    with open(path.join(report_dir, ".saved"), "rb") as f:
+        return pickle.load(f)
 
-    report_html = get_report_html(REPORT_TEMPLATE_DIR, sc_stats, tenant, start, end, template=template)
-    with open(html_filename, 'w') as fd:
-        fd.write(report_html)
-    
-    weasyprint.HTML(html_filename).write_pdf(pdf_filename, options={'optimize_images': True})                    
 
+def render_report(sc_stats, tenant, start, end, template='report.html.template', exporter=None, figure_cache=None, renderer='plotly',
+                  j2_env=None, font_config=None, url_fetcher=None, section_workers=0, optimizer=None, templates=None, formats=('pdf',),
+                  sc_plots=None, report_html=None):
+    """
+    Exports the figures once (unless sc_plots whose figures were already saved is given), then writes each requested format (pdf, standalone html, json stats)
+    for each template (templates, or just template) of an already fetched report.
+    report_html maps templates to HTML already rendered for this report, see get_reports_html.
+    A render worker passes its long lived fonts and url fetcher, templates come from TEMPLATES unless j2_env is given.
+    With section_workers the report's sections are laid out in that many processes and merged.
+    An SvgOptimizer minifies or rasterizes the exported figures before layout.
+    """
+    paths = report_paths(tenant, start, end)
+
+    if sc_plots is None:
+        sc_plots = StellarCyberPlots(sc_stats, renderer=renderer)
+        sc_plots.save_figures(paths['plots_dir'], exporter=exporter, cache=figure_cache, optimizer=optimizer)
+        if optimizer is not None:
+            print("SVG optimization totals so far:", optimizer.summary())
+
+    if 'json' in formats:
+        write_stats_json(sc_stats, paths['json_filename'])
+
+    for template in templates or [template]:
+        template_paths = report_paths(tenant, start, end, template)
+        html_source = (report_html or {}).get(template)
+        if html_source is None:
+            html_source = get_report_html(REPORT_TEMPLATE_DIR, sc_stats, tenant, start, end, template=template, j2_env=j2_env)
+        with open(template_paths['html_filename'], 'w') as fd:
+            fd.write(html_source)
+
+        if 'pdf' in formats and section_workers:
+            write_pdf_sections(template_paths['html_filename'], template_paths['pdf_filename'], template, max_workers=section_workers,
+                               url_fetcher=url_fetcher)
+        elif 'pdf' in formats:
+            html = weasyprint.HTML(template_paths['html_filename'], url_fetcher=url_fetcher or weasyprint.default_url_fetcher)
+            html.write_pdf(template_paths['pdf_filename'], font_config=font_config, **PDF_OPTIONS)
+        if 'pdf' in formats:
+            ReportCatalog(REPORT_DIR).record(template_paths['pdf_filename'], tenant, start, end, template, sc_stats)
+
+        if 'html' in formats:
+            write_standalone_html(template_paths['html_filename'], template_paths['standalone_html_filename'])
+
+    return sc_plots
+
+
+def run_report(api, tenant, start, end, template='report.html.template', parallel=False, max_workers=4, fused=False, sc_stats=None, exporter=None, figure_cache=None, renderer='plotly',
+               render_client=None, section_workers=0, optimizer=None, templates=None, formats=('pdf',), progress=None, on_result=None,
+               should_stop=None, cases_in_flight=CASES_MAX_IN_FLIGHT):
+    """
+    Fetches one report and renders it in every requested template and format from that single fetch.
+    The rendering is handed to a render worker when render_client is given.
+    progress(fraction, message) is called between stages, a job queue stops the run by raising from it;
+    should_stop() is checked before each collector so the run can be stopped while querying as well.
+    on_result(sc_stats, attribute_names) is called as each collector finishes, see StellarCyberStats.query_stats.
+    """
+    progress = progress or (lambda fraction, message: None)
+    progress(0.05, "Querying stats")
+    sc_stats = fetch_report_data(api, tenant, start, end, parallel=parallel, max_workers=max_workers, fused=fused, sc_stats=sc_stats,
+                                 on_result=on_result, should_stop=should_stop, cases_in_flight=cases_in_flight)
+    progress(0.6, "Rendering")
+
+    if render_client is not None:
+        render_client.render(tenant, start, end, template=template, renderer=renderer, section_workers=section_workers,
+                             templates=templates, formats=formats,
+                             optimize=None if optimizer is None else {'precision': optimizer.precision, 'rasterize': sorted(optimizer.rasterize), 'dpi': optimizer.dpi,
+                                                                     'measure_render': optimizer.measure_render})
+        progress(1.0, "Done")
+        return sc_stats, StellarCyberPlots(sc_stats, renderer=renderer)
+
+    sc_plots = render_report(sc_stats, tenant, start, end, template=template, exporter=exporter, figure_cache=figure_cache, renderer=renderer,
+                             section_workers=section_workers, optimizer=optimizer, templates=templates, formats=formats)
+    progress(1.0, "Done")
     return sc_stats, sc_plots
 
 
+def run_reports(api, tenants, start, end, template='report.html.template', parallel=False, max_workers=4, fused=False, export_workers=None, figure_cache=None, renderer='plotly',
+                render_client=None, section_workers=0, optimizer=None, templates=None, formats=('pdf',), cases_in_flight=CASES_MAX_IN_FLIGHT,
+                progress=None, should_stop=None):
+    """
+    Runs one report per tenant, fetching the stats of all tenants together, exporting every
+    report's figures in one batch through a warm export pool and rendering each template's HTML
+    for all tenants at once. Returns {tenant: (sc_stats, sc_plots)}
+    progress and should_stop work as in run_report, stopped stats aren't saved or rendered.
+    """
+    progress = progress or (lambda fraction, message: None)
+    progress(0.05, f"Querying stats for {len(tenants)} tenants")
+    tenant_stats = StellarCyberStats.for_tenants(api, tenants, start, end, "", parallel=parallel, max_workers=max_workers, fused=fused,
+                                                cases_in_flight=cases_in_flight, should_stop=should_stop)
+    progress(0.6, "Rendering")
+    if any(sc_stats.stopped for sc_stats in tenant_stats.values()):
+        return {}
+
+    if render_client is not None:
+        # The render worker exports the figures itself
+        reports = {}
+        for i, tenant in enumerate(tenants):
+            reports[tenant] = run_report(api, tenant, start, end, template=template, sc_stats=tenant_stats[tenant], renderer=renderer,
+                                         render_client=render_client, section_workers=section_workers, optimizer=optimizer,
+                                         templates=templates, formats=formats)
+            progress(0.6 + 0.4 * (i + 1) / len(tenants), f"Rendered {tenant}")
+        return reports
+
+    for tenant in tenants:
+        fetch_report_data(api, tenant, start, end, sc_stats=tenant_stats[tenant])
+    TEMPLATES.precompile()
+    tenant_plots = {tenant: StellarCyberPlots(tenant_stats[tenant], renderer=renderer) for tenant in tenants}
+
+    with FigureExporter(max_workers=export_workers) as exporter:
+        save_figures_many([(tenant_plots[tenant], report_paths(tenant, start, end)['plots_dir']) for tenant in tenants],
+                          exporter=exporter, cache=figure_cache, optimizer=optimizer)
+    if optimizer is not None:
+        print("SVG optimization totals:", optimizer.summary())
+
+    progress(0.8, "Writing reports")
+
+    html_by_template = {t: get_reports_html(tenant_stats, start, end, template=t) for t in templates or [template]}
+    for tenant in tenants:
+        render_report(tenant_stats[tenant], tenant, start, end, template=template, renderer=renderer, section_workers=section_workers,
+                      templates=templates, formats=formats, sc_plots=tenant_plots[tenant],
+                      report_html={t: html_by_tenant[tenant] for t, html_by_tenant in html_by_template.items()})
+    progress(1.0, "Done")
+    return {tenant: (tenant_stats[tenant], tenant_plots[tenant]) for tenant in tenants}
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         prog='ExecutiveReportGenerator',
         description='Generate PDF reports from Stellar Cyber',
         epilog='Text at the bottom of help'
     )
-    parser.add_argument('tenant')
+    parser.add_argument('tenant', nargs='+', help='One or more tenant names')
     parser.add_argument('start_date')
     parser.add_argument('end_date')
+    parser.add_argument('--templates', nargs='+', default=['report.html.template'], metavar='TEMPLATE', help='Render the report with each of these templates')
+    parser.add_argument('--formats', nargs='+', default=['pdf'], choices=OUTPUT_FORMATS, help='Outputs per template: pdf, standalone html with inline SVG/CSS, json stats dump')
+    parser.add_argument('--parallel', action='store_true', help='Run the stats collectors concurrently')
+    parser.add_argument('--workers', type=int, default=4, help='Worker pool size for --parallel')
+    parser.add_argument('--fused', action='store_true', help='Query all aella-ade-* volume stats in a single request')
+    parser.add_argument('--cases-in-flight', type=int, default=CASES_MAX_IN_FLIGHT, help='Stream the cases in this many concurrent time slices (1 pages through them in one stream)')
+    parser.add_argument('--export-workers', type=int, default=0, help='Export chart SVGs across this many worker processes (0 exports in-process)')
+    parser.add_argument('--renderer', choices=['plotly', 'native'], default='plotly', help='native writes the simple line and bar charts without kaleido')
+    parser.add_argument('--section-workers', type=int, default=0, help='Lay out the report sections in this many processes and merge the PDFs (0 renders in one pass)')
+    parser.add_argument('--optimize-svg', action='store_true', help='Minify the exported SVGs before layout')
+    parser.add_argument('--measure-svg-render', action='store_true', help='With --optimize-svg or --rasterize, time each figure in WeasyPrint before and after to report the render time saved')
+    parser.add_argument('--rasterize', nargs='*', default=[], metavar='FIGURE', help='Figures to embed as PNG instead of vector, e.g. alert_map all_data_sources_volume_sankey')
+    parser.add_argument('--raster-dpi', type=int, default=150, help='Resolution of --rasterize figures')
+    parser.add_argument('--render-worker', metavar='HOST:PORT', help='Hand rendering to a running render_worker.py')
+    parser.add_argument('--no-cache', action='store_true', help='Always query the Stellar Cyber instance and render every chart, bypassing the query, daily bucket and figure caches')
 
     args = parser.parse_args()
     print(args)
@@ -107,7 +322,29 @@ if __name__ == '__main__':
         url=host, 
         username=user, 
         api_key=api_key, 
-        deployment=deployment_type
+        deployment=deployment_type,
+        pool_size=max(10, args.workers + args.cases_in_flight),
+        cache=None if args.no_cache else QueryCache(),
+        bucket_store=None if args.no_cache else DailyBucketStore()
     )
 
-    run_report(api, args.tenant, args.start_date, args.end_date)
\ No newline at end of file
+    figure_cache = None if args.no_cache else FigureCache()
+    optimizer = SvgOptimizer(rasterize=args.rasterize, dpi=args.raster_dpi, measure_render=args.measure_svg_render) if args.optimize_svg or args.rasterize or args.measure_svg_render else None
+    render_client = None
+    if args.render_worker:
+        from render_worker import RenderClient, parse_address
+        render_client = RenderClient(address=parse_address(args.render_worker))
+
+    report_options = dict(
+        parallel=args.parallel, max_workers=args.workers, fused=args.fused, cases_in_flight=args.cases_in_flight,
+        figure_cache=figure_cache, renderer=args.renderer, render_client=render_client,
+        section_workers=args.section_workers, optimizer=optimizer,
+        templates=args.templates, formats=args.formats
+    )
+    if len(args.tenant) > 1:
+        run_reports(api, args.tenant, args.start_date, args.end_date, export_workers=args.export_workers or None, **report_options)
+    elif args.export_workers:
+        with FigureExporter(max_workers=args.export_workers) as exporter:
+            run_report(api, args.tenant[0], args.start_date, args.end_date, exporter=exporter, **report_options)
+    else:
+        run_report(api, args.tenant[0], args.start_date, args.end_date, **report_options)
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import shutil
+
+# Per report files, everything else in the template folder is a shared asset
+REPORT_OWN_FILES = ("report.html", "plots")
+TEMPLATE_SUFFIX = ".html.template"
+
+asset_versions = {}
+
+
+def asset_files(template_dir):
+    """ Paths (relative to template_dir) of the fonts, images and CSS the reports use """
+    files = []
+    for root, dirs, names in os.walk(template_dir):
+        dirs[:] = sorted(d for d in dirs if d not in REPORT_OWN_FILES)
+        for name in sorted(names):
+            if name.endswith(TEMPLATE_SUFFIX) or name in REPORT_OWN_FILES:
+                continue
+            files.append(os.path.relpath(os.path.join(root, name), template_dir))
+    return files
+
+
+def asset_version(template_dir):
+    """ Hash of the asset files' names and contents, recomputed only when a file's size or mtime changes """
+    files = asset_files(template_dir)
+    stats = [os.stat(os.path.join(template_dir, f)) for f in files]
+    signature = tuple((f, st.st_size, st.st_mtime_ns) for f, st in zip(files, stats))
+    if asset_versions.get(template_dir, (None,))[0] != signature:
+        digest = hashlib.sha256()
+        for f in files:
+            digest.update(f.encode("utf-8") + b"\0")
+            with open(os.path.join(template_dir, f), "rb") as fd:
+                digest.update(hashlib.sha256(fd.read()).digest())
+        asset_versions[template_dir] = (signature, digest.hexdigest()[0:16])
+    return asset_versions[template_dir][1]
+
+
+def publish_assets(template_dir, store_dir):
+    """ Copies the current assets into store_dir/<version> once, returns that folder """
+    version_dir = os.path.join(store_dir, asset_version(template_dir))
+    if os.path.isdir(version_dir):
+        return version_dir
+
+    tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for f in asset_files(template_dir):
+        os.makedirs(os.path.dirname(os.path.join(tmp_dir, f)), exist_ok=True)
+        shutil.copy2(os.path.join(template_dir, f), os.path.join(tmp_dir, f))
+    try:
+        os.rename(tmp_dir, version_dir)
+    except OSError:
+        # Published meanwhile by another process
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return version_dir
+
+
+def link_assets(dst_dir, template_dir, store_dir):
+    """
+    Makes the shared assets available in a report's folder as hard links into the
+    versioned store (copies where links aren't possible). Existing links to the current
+    version are kept, so calling it for an existing report is cheap.
+    """
+    version_dir = publish_assets(template_dir, store_dir)
+    for f in asset_files(version_dir):
+        src, dst = os.path.join(version_dir, f), os.path.join(dst_dir, f)
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    return version_dir
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import time
+from contextlib import closing
+from glob import glob
+
+CATALOG_FILE = "catalog.sqlite"
+CATALOG_COLUMNS = (
+    'pdf_path', 'report_dir', 'tenant', 'start', 'end', 'template', 'pdf_bytes', 'generated_at',
+    'critical_incidents', 'high_incidents', 'critical_alerts', 'average_daily_volume', 'distinct_data_sources'
+)
+
+
+def headline_metrics(sc_stats):
+    """ The figures shown next to a report in the catalog """
+    _, data_sources_sorted, _ = sc_stats.combine_data_sources()
+    return {
+        'critical_incidents': int(sc_stats.incident_stats['cumulative_critical_incident_count']),
+        'high_incidents': int(sc_stats.incident_stats['high_incident_count']),
+        'critical_alerts': int(sc_stats.alert_stats['cumulative_critical_alert_count']),
+        'average_daily_volume': float(sc_stats.volume_stats['average_daily_volume']),
+        'distinct_data_sources': len(data_sources_sorted),
+    }
+
+
+class ReportCatalog():
+    """
+    SQLite index of the generated reports, one row per PDF, kept in the reports folder.
+    run_report adds rows as it writes PDFs, the app filters and pages through it without
+    touching the report folders.
+    """
+
+    def __init__(self, report_dir):
+        self.report_dir = report_dir
+        self.path = os.path.join(report_dir, CATALOG_FILE)
+        os.makedirs(report_dir, exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    pdf_path TEXT PRIMARY KEY, report_dir TEXT, tenant TEXT, start TEXT, end TEXT, template TEXT,
+                    pdf_bytes INTEGER, generated_at REAL,
+                    critical_incidents INTEGER, high_incidents INTEGER, critical_alerts INTEGER,
+                    average_daily_volume REAL, distinct_data_sources INTEGER
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_tenant ON reports (tenant, generated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_generated_at ON reports (generated_at)")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def relative(self, file_path):
+        return os.path.relpath(file_path, self.report_dir)
+
+    def record(self, pdf_filename, tenant, start, end, template, sc_stats=None, generated_at=None):
+        row = {
+            'pdf_path': self.relative(pdf_filename),
+            'report_dir': self.relative(os.path.dirname(pdf_filename)),
+            'tenant': tenant,
+            'start': start,
+            'end': end,
+            'template': template,
+            'pdf_bytes': os.path.getsize(pdf_filename),
+            'generated_at': generated_at or time.time(),
+        }
+        try:
+            row.update(headline_metrics(sc_stats) if sc_stats is not None else {})
+        except (AttributeError, KeyError, TypeError):
+            # Failed collectors leave their stats empty, the row is still worth having
+            pass
+        columns = [c for c in CATALOG_COLUMNS if c in row]
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO reports ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [row[c] for c in columns]
+            )
+
+    def import_existing(self):
+        """ Adds PDFs generated before the catalog existed, range and tenant come from the folder name """
+        with closing(self.connect()) as conn:
+            known = {r['pdf_path'] for r in conn.execute("SELECT pdf_path FROM reports")}
+        for pdf_filename in glob(os.path.join(self.report_dir, "*", "*.pdf")):
+            if self.relative(pdf_filename) in known:
+                continue
+            folder = os.path.basename(os.path.dirname(pdf_filename))
+            tenant, _, date_range = folder.rpartition("_")
+            start, _, end = date_range.partition("-")
+            start, end = (f"{d[0:4]}-{d[4:6]}-{d[6:8]}" for d in (start, end))
+            self.record(pdf_filename, tenant, start, end, None, generated_at=os.path.getmtime(pdf_filename))
+
+    def remove(self, pdf_path):
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM reports WHERE pdf_path = ?", (pdf_path,))
+
+    def prune_missing(self):
+        """ Drops the rows of reports whose PDF was deleted, returns how many """
+        with closing(self.connect()) as conn:
+            paths = [r['pdf_path'] for r in conn.execute("SELECT pdf_path FROM reports")]
+        missing = [p for p in paths if not os.path.exists(self.full_path(p))]
+        for pdf_path in missing:
+            self.remove(pdf_path)
+        return len(missing)
+
+    def where(self, tenant=None, text=None):
+        clauses, params = [], []
+        if tenant:
+            clauses.append("tenant = ?")
+            params.append(tenant)
+        if text:
+            clauses.append("(tenant LIKE ? OR report_dir LIKE ?)")
+            params += [f"%{text}%", f"%{text}%"]
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, tenant=None, text=None):
+        where, params = self.where(tenant, text)
+        with closing(self.connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM reports{where}", params).fetchone()[0]
+
+    def search(self, tenant=None, text=None, limit=20, offset=0):
+        """ Newest first page of catalog rows as dicts """
+        where, params = self.where(tenant, text)
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                f"SELECT * FROM reports{where} ORDER BY generated_at DESC LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def tenants(self):
+        with closing(self.connect()) as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT tenant FROM reports ORDER BY tenant")]
+
+    def full_path(self, relative_path):
+        return os.path.join(self.report_dir, relative_path)
@@ -0,0 +1,95 @@
+import base64
+import json
+import mimetypes
+import os
+import re
+from collections.abc import Iterable
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup
+
+OUTPUT_FORMATS = ('pdf', 'html', 'json')
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def data_uri(file_path):
+    mime_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    if file_path.endswith(".ttf"):
+        mime_type = "font/ttf"
+    with open(file_path, "rb") as f:
+        return f"data:{mime_type};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+
+def inline_css(css_text, base_dir):
+    """ CSS with every url() to a local file (fonts, cover images) replaced by a data URI """
+    def replace(match):
+        file_path = os.path.join(base_dir, match.group(2))
+        if match.group(2).startswith(("data:", "http:", "https:")) or not os.path.isfile(file_path):
+            return match.group(0)
+        return f'url("{data_uri(file_path)}")'
+    return CSS_URL_RE.sub(replace, css_text)
+
+
+def write_standalone_html(html_filename, dst_filename):
+    """
+    Single file copy of a rendered report: stylesheets are inlined with their fonts and images,
+    plot <img> tags are replaced by the SVG markup itself.
+    """
+    base_dir = os.path.dirname(html_filename)
+    with open(html_filename, "r") as f:
+        soup = BeautifulSoup(f.read(), "html.parser")
+
+    for link in soup.find_all("link", rel="stylesheet"):
+        css_path = os.path.join(base_dir, link["href"])
+        if not os.path.isfile(css_path):
+            continue
+        with open(css_path, "r") as f:
+            style = soup.new_tag("style")
+            style.string = inline_css(f.read(), os.path.dirname(css_path))
+        link.replace_with(style)
+
+    for img in soup.find_all("img"):
+        img_path = os.path.join(base_dir, img.get("src", ""))
+        if not os.path.isfile(img_path):
+            continue
+        if img_path.endswith(".svg"):
+            with open(img_path, "r") as f:
+                svg = BeautifulSoup(f.read(), "html.parser").find("svg")
+            if svg is not None:
+                img.replace_with(svg)
+        else:
+            img["src"] = data_uri(img_path)
+
+    with open(dst_filename, "w") as f:
+        f.write(str(soup))
+
+
+def to_json_value(value):
+    """ json.dump default for what the collectors return """
+    if isinstance(value, pd.DataFrame):
+        return json.loads(value.to_json(orient="records", date_format="iso"))
+    if isinstance(value, pd.Series):
+        return json.loads(value.to_json(orient="values", date_format="iso"))
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        return value.isoformat()
+    if isinstance(value, Iterable) and not isinstance(value, (str, bytes)):
+        return list(value)
+    return str(value)
+
+
+def write_stats_json(sc_stats, dst_filename):
+    """ Every collector's stats plus the report range as JSON """
+    stats = {
+        'tenant': sc_stats.tenant,
+        'start': sc_stats.start,
+        'end': sc_stats.end,
+        'query_timestamp': sc_stats.query_timestamp,
+        'stats': sc_stats.list_stats(),
+    }
+    with open(dst_filename, "w") as f:
+        json.dump(stats, f, default=to_json_value)
@@ -0,0 +1,234 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import closing
+from query_cache import CACHE_DIR, QueryCache
+from stats.bucket_store import DailyBucketStore
+from stellar_api import StellarCyberAPI
+from stellar_export import FigureCache
+from stellar_plots import StellarCyberPlots
+from stellar_stats import StellarCyberStats
+from report import report_paths, run_report, run_reports
+
+JOBS_DB = os.path.join(CACHE_DIR, "jobs.sqlite")
+JOB_STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue():
+    """
+    Report runs persisted in SQLite, so queued and finished jobs outlive app reruns and restarts.
+    A job only names its saved config, credentials are read from that file when it runs.
+    Batch jobs list their tenants in tenants and are fetched and rendered together by run_reports.
+    """
+
+    def __init__(self, db_path=JOBS_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, config TEXT, tenant TEXT, start TEXT, end TEXT, template TEXT,
+                    status TEXT, progress REAL, message TEXT, error TEXT, report_dir TEXT, cancel_requested INTEGER DEFAULT 0,
+                    created_at REAL, started_at REAL, finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            if 'tenants' not in [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                # Databases created before batch jobs
+                conn.execute("ALTER TABLE jobs ADD COLUMN tenants TEXT")
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, config, tenant, start, end, template='report.html.template', tenants=None):
+        with closing(self.connect()) as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (config, tenant, start, end, template, tenants, status, progress, message, report_dir, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, 'Queued', ?, ?)",
+                (config, tenant, start, end, template, json.dumps(tenants) if tenants else None,
+                 report_paths(tenant if not tenants else tenants[-1], start, end)['report_dir'], time.time())
+            )
+            return cursor.lastrowid
+
+    def submit_batch(self, config, tenants, start, end, template='report.html.template'):
+        """ One job for several tenants, opening it shows the last tenant's report """
+        return self.submit(config, ", ".join(tenants), start, end, template=template, tenants=list(tenants))
+
+    def claim(self):
+        """ Marks the oldest queued job running and returns it, None when the queue is empty """
+        with closing(self.connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = 'running', message = 'Starting', started_at = ? WHERE id = ?",
+                             (time.time(), row['id']))
+            conn.execute("COMMIT")
+        return dict(row) if row is not None else None
+
+    def update(self, job_id, progress, message):
+        """ Records progress, returns True when the job was asked to stop """
+        with closing(self.connect()) as conn:
+            conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?", (progress, message, job_id))
+        return self.cancel_requested(job_id)
+
+    def cancel_requested(self, job_id):
+        with closing(self.connect()) as conn:
+            return bool(conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+    def finish(self, job_id, status, message, error=None):
+        with closing(self.connect()) as conn:
+            conn.execute("UPDATE jobs SET status = ?, message = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (status, message, error, time.time(), job_id))
+
+    def cancel(self, job_id):
+        """ Queued jobs are cancelled right away, running ones before their next collector or stage """
+        with closing(self.connect()) as conn:
+            conn.execute("UPDATE jobs SET status = 'cancelled', message = 'Cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                         (time.time(), job_id))
+            conn.execute("UPDATE jobs SET cancel_requested = 1, message = 'Cancelling' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def requeue_interrupted(self):
+        """ Jobs left running by a stopped app process start over """
+        with closing(self.connect()) as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', progress = 0, message = 'Requeued after restart' WHERE status = 'running'")
+            conn.execute("UPDATE jobs SET status = 'cancelled', message = 'Cancelled' WHERE status = 'queued' AND cancel_requested = 1")
+
+    def clear_finished(self):
+        with closing(self.connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled')")
+
+    def jobs(self, limit=50):
+        """ Newest first """
+        with closing(self.connect()) as conn:
+            return [dict(r) for r in conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))]
+
+
+class LiveReport():
+    """
+    Stats of a running job as its collectors finish. Pages show the sections whose
+    inputs are in ready and placeholders for the rest until done.
+    """
+
+    def __init__(self):
+        self.sc_stats = None
+        self.sc_plots = None
+        self.ready = set()
+        self.done = False
+        self.lock = threading.Lock()
+
+    def on_result(self, sc_stats, attribute_names):
+        with self.lock:
+            if self.sc_stats is None:
+                self.sc_stats = sc_stats
+                self.sc_plots = StellarCyberPlots(sc_stats)
+            self.ready.update(attribute_names)
+
+    def missing(self, *attribute_names):
+        return [] if self.done else [a for a in attribute_names if a not in self.ready]
+
+    def fraction(self):
+        """ Share of the collector results in, daily_date_scale isn't queried """
+        return len(self.ready) / (len(StellarCyberStats.stats_attributes) - 1)
+
+
+class JobWorkerPool():
+    """
+    Threads taking jobs off a JobQueue and running them with run_report, or run_reports for batch jobs.
+    Each job builds its API from the saved config it names in config_dir, the query, bucket and figure
+    caches are shared. Running single tenant jobs publish their collector results in live, keyed by job id.
+    """
+
+    def __init__(self, queue, config_dir, size=2, poll_interval=1.0, report_options=None):
+        self.queue = queue
+        self.config_dir = config_dir
+        self.size = size
+        self.poll_interval = poll_interval
+        self.report_options = report_options or {}
+        self.query_cache = QueryCache()
+        self.bucket_store = DailyBucketStore()
+        self.figure_cache = FigureCache()
+        self.stopping = threading.Event()
+        self.threads = []
+        self.live = {}
+
+    def start(self):
+        self.queue.requeue_interrupted()
+        for i in range(self.size):
+            thread = threading.Thread(target=self.work, name=f"report-job-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def api(self, config):
+        with open(os.path.join(self.config_dir, config), "rb") as f:
+            conf_dict = pickle.load(f)
+        return StellarCyberAPI(
+            url=conf_dict['host'],
+            username=conf_dict['user'],
+            api_key=conf_dict['api_key'],
+            deployment=conf_dict['deployment_type'],
+            cache=self.query_cache,
+            bucket_store=self.bucket_store
+        )
+
+    def work(self):
+        while not self.stopping.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            self.run(job)
+
+    def run(self, job):
+        tenants = json.loads(job['tenants']) if job.get('tenants') else None
+        live = LiveReport()
+        if tenants is None:
+            self.live[job['id']] = live
+
+        def progress(fraction, message):
+            # At 1.0 the report is written and cataloged, a late cancel doesn't undo it
+            if self.queue.update(job['id'], fraction, message) and fraction < 1:
+                raise JobCancelled()
+
+        def should_stop():
+            return self.queue.cancel_requested(job['id'])
+
+        def on_result(sc_stats, attribute_names):
+            live.on_result(sc_stats, attribute_names)
+            self.queue.update(job['id'], 0.05 + 0.55 * live.fraction(), f"Collected {', '.join(attribute_names)}")
+
+        try:
+            progress(0.0, "Connecting")
+            if tenants is not None:
+                run_reports(self.api(job['config']), tenants, job['start'], job['end'], template=job['template'],
+                            figure_cache=self.figure_cache, progress=progress, should_stop=should_stop, **self.report_options)
+            else:
+                run_report(self.api(job['config']), job['tenant'], job['start'], job['end'], template=job['template'],
+                           figure_cache=self.figure_cache, progress=progress, on_result=on_result,
+                           should_stop=should_stop, **self.report_options)
+            self.queue.finish(job['id'], 'done', "Done")
+        except JobCancelled:
+            self.queue.finish(job['id'], 'cancelled', "Cancelled")
+        except Exception as e:
+            print(f"Report job {job['id']} failed:", e)
+            print(traceback.format_exc())
+            self.queue.finish(job['id'], 'failed', "Failed", error=repr(e))
+        finally:
+            live.done = True
+            self.live.pop(job['id'], None)
@@ -2,11 +2,34 @@ import pandas as pd
 import streamlit as st
 from numerize import numerize
 from utils import humansize
+from stellar_plots import DATA_SOURCE_STATS, FIGURE_INPUTS
+
+
+def live_report():
+    """ LiveReport of the running job this session is watching, None once it's done """
+    live = st.session_state.get('live_report')
+    return live if live is not None and not live.done else None
+
+
+def section_ready(*attribute_names):
+    """ True when the stats a section needs are in, otherwise shows a placeholder in its place """
+    live = live_report()
+    missing = [] if live is None else live.missing(*attribute_names)
+    if missing:
+        st.info(f":hourglass_flowing_sand: Waiting for {', '.join(a.replace('_', ' ') for a in missing)}")
+    return not missing
+
+
+def show_figure(fig_name):
+    if section_ready(*FIGURE_INPUTS[fig_name]):
+        st.write(st.session_state.sc_plots.get_figure(fig_name))
 
 
 def stats_page(fn):
     def wrapper():
-        if 'sc_stats' not in st.session_state:
+        if 'sc_stats' not in st.session_state and live_report() is not None:
+            st.info(":hourglass_flowing_sand: Waiting for the first results")
+        elif 'sc_stats' not in st.session_state:
             st.info("No Data Loaded")
         elif 'sc_plots' not in st.session_state:
             st.warning("No Charts Available")
@@ -18,40 +41,44 @@ def stats_page(fn):
 @stats_page
 def show_deployment_summary():
     sc_stats = st.session_state.sc_stats
-    categories_sorted, data_sources_sorted, volume_sorted = sc_stats.combine_data_sources()
 
     st.caption("The following summary captures high level statistics for the deployment over the specified time period.")
 
     st.divider()
     st.subheader("Detections")
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric(":orange[Critical Cases Detected]", numerize.numerize(sc_stats.incident_stats['cumulative_critical_incident_count'],2))
-    with col2:
-        st.metric(":orange[Critical Alerts Detected]", numerize.numerize(sc_stats.alert_stats['cumulative_critical_alert_count'],2))
-    with col3:
-        st.metric(":orange[Distinct Alert Types Triggered]", numerize.numerize(sc_stats.alert_stats['unique_alert_type_count'],2))
+    if section_ready("incident_stats", "alert_stats"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(":orange[Critical Cases Detected]", numerize.numerize(sc_stats.incident_stats['cumulative_critical_incident_count'],2))
+        with col2:
+            st.metric(":orange[Critical Alerts Detected]", numerize.numerize(sc_stats.alert_stats['cumulative_critical_alert_count'],2))
+        with col3:
+            st.metric(":orange[Distinct Alert Types Triggered]", numerize.numerize(sc_stats.alert_stats['unique_alert_type_count'],2))
     st.divider()
     st.subheader("Visibility")
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric(":orange[Average Daily Data Volume]", humansize(sc_stats.volume_stats['average_daily_volume'],2))
-    with col2:
-        st.metric(":orange[Average Daily Discovered Assets]", numerize.numerize(sc_stats.asset_stats['average_daily_assets'],2))
-    with col3:
-        st.metric(":orange[Distinct Data Sources]", numerize.numerize(len(data_sources_sorted),0))
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric(":orange[Security Sensors Deployed]", numerize.numerize(sc_stats.security_sensor_stats['unique_sensors']))
-    with col2:
-        st.metric(":orange[Windows Sensors Deployed]", numerize.numerize(sc_stats.windows_sensor_stats['unique_sensors']))
-    with col3:
-        st.metric(":orange[Linux Sensors Deployed]", numerize.numerize(sc_stats.linux_sensor_stats['unique_sensors']))
+    if section_ready("volume_stats", "asset_stats", *DATA_SOURCE_STATS):
+        categories_sorted, data_sources_sorted, volume_sorted = sc_stats.combine_data_sources()
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(":orange[Average Daily Data Volume]", humansize(sc_stats.volume_stats['average_daily_volume'],2))
+        with col2:
+            st.metric(":orange[Average Daily Discovered Assets]", numerize.numerize(sc_stats.asset_stats['average_daily_assets'],2))
+        with col3:
+            st.metric(":orange[Distinct Data Sources]", numerize.numerize(len(data_sources_sorted),0))
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(":orange[Security Sensors Deployed]", numerize.numerize(sc_stats.security_sensor_stats['unique_sensors']))
+        with col2:
+            st.metric(":orange[Windows Sensors Deployed]", numerize.numerize(sc_stats.windows_sensor_stats['unique_sensors']))
+        with col3:
+            st.metric(":orange[Linux Sensors Deployed]", numerize.numerize(sc_stats.linux_sensor_stats['unique_sensors']))
         
 
 @stats_page
 def show_incidents_stats():
     st.caption("A Case is a single attack story, correlating multiple likely related alerts and observables together from every data source. Stellar Cyber uses Machine Learning to perform correlation and security analysts can further edit or build custom Cases. A Critical Case represents very high risk connected behaviors and is defined as a risk score >= 75 in Stellar Cyber.")
+    if not section_ready("incident_stats"):
+        return
     incident_stats = st.session_state.sc_stats.incident_stats
 
     st.subheader("Critical Cases Over Time")
@@ -74,15 +101,10 @@ def show_alerts():
 
     st.subheader("Alerts Over Time")
     sc_stats = st.session_state.sc_stats
-    alert_stage_stats = sc_stats.alert_stage_stats
-    alert_tactic_stats = sc_stats.alert_tactic_stats
-    alert_geo_stats = sc_stats.alert_geo_stats
-    top_alerts = sc_stats.alert_stats['top_3_alerts']
-
 
-    st.write(st.session_state.sc_plots.get_figure("alert_line_graph"))
-    st.write(st.session_state.sc_plots.get_figure("stage_heatmap"))
-    st.write(st.session_state.sc_plots.get_figure("tactic_heatmap"))
+    show_figure("alert_line_graph")
+    show_figure("stage_heatmap")
+    show_figure("tactic_heatmap")
 
     st.divider()
     st.subheader("High Fidelity Alerts Source Map")
@@ -90,31 +112,27 @@ def show_alerts():
                     Fidelity Alerts. Not all Alerts will have geocodable elements, so this map is not exhaustive of
                     all Alerts. 
                """)
-    st.write(st.session_state.sc_plots.get_figure("alert_map"))
+    show_figure("alert_map")
 
     st.subheader("Top 3 Alerts by Risk Score")
-    st.write(pd.DataFrame(top_alerts))
+    if section_ready("alert_stats"):
+        st.write(pd.DataFrame(sc_stats.alert_stats['top_3_alerts']))
 
 
 @stats_page
 def show_assets():
-    top_assets = st.session_state.sc_stats.top_assets_stats['top_5_assets']
-
     st.header("Assets")
     st.caption("""Assets are continuously discovered and resolved across every data source in Stellar Cyber.
                 Vulnerabilities, alerts, and other activity are used together to produce a risk score for
                 providing context in investigations. """)
     
     st.subheader("Top 5 Assets by Risk Score")
-    st.write(pd.DataFrame(top_assets))
+    if section_ready("top_assets_stats"):
+        st.write(pd.DataFrame(st.session_state.sc_stats.top_assets_stats['top_5_assets']))
 
 
 @stats_page
 def show_visibility():
-    sc_stats = st.session_state.sc_stats
-    volume_stats = sc_stats.volume_stats
-    asset_stats = sc_stats.asset_stats
-
     st.header("Visibility")
     st.caption("""Stellar Cyber collects data from its own Sensors and Third Party Tools. The following charts
                 use the following categories - Sensors are defined as data generated from Stellar Cyber
@@ -122,12 +140,12 @@ def show_visibility():
                 collected via API Connectors. Log Sources are defined as Third Party Tools collected via
                 streaming logs.""")
     st.subheader("Visibility Over Time")
-    st.write(st.session_state.sc_plots.get_figure("volume_assets_line_graph"))
-    st.write(st.session_state.sc_plots.get_figure("volume_category_trends"))
+    show_figure("volume_assets_line_graph")
+    show_figure("volume_category_trends")
 
     st.subheader("Top 10 Data Sources by Cumulative Volume")
-    st.write(st.session_state.sc_plots.get_figure("top_data_sources_volume"))
+    show_figure("top_data_sources_volume")
 
     st.subheader("Top 20 Data Sources by Cumulative Volume")
-    st.write(st.session_state.sc_plots.get_figure("all_data_sources_volume_sankey"))
+    show_figure("all_data_sources_volume_sankey")
 
@@ -0,0 +1,148 @@
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+from pypdf import PdfReader, PdfWriter
+import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+from query_cache import CACHE_DIR
+from utils import atomic_write
+
+# Page count of each section in the last render, used to guess where the next one starts
+SECTION_PAGES_PATH = os.path.join(CACHE_DIR, "section_pages.json")
+
+# A section's first page is an ordinary page, not the cover, and numbering continues from the previous section
+SECTION_PAGE_STYLE = "@page :first {{ background: none; margin: {margin}; counter-set: page {first_page} }}"
+# Margin of the stylesheet's plain @page rule, the one :first pages would otherwise have
+PAGE_MARGIN_RE = re.compile(r"@page\s*\{[^}]*?\bmargin\s*:\s*([^;}]+)")
+# Passed as keyword options, weasyprint ignores an options= dict
+PDF_OPTIONS = {'optimize_images': True}
+
+# Per pool worker process
+font_config = None
+url_fetcher = None
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def split_sections(report_html):
+    """ One standalone HTML document per top level <article> of the report, as [(article id, html)] """
+    soup = BeautifulSoup(report_html, "html.parser")
+    head = str(soup.head) if soup.head else ""
+    return [
+        (article.get("id", str(i)), f"<html>{head}<body>{article}</body></html>")
+        for i, article in enumerate(soup.body.find_all("article", recursive=False))
+    ]
+
+
+def page_margin(section_html, base_url):
+    """ Page margin set by the report's stylesheets, "0" when they don't set one """
+    soup = BeautifulSoup(section_html, "html.parser")
+    for link in soup.find_all("link", rel="stylesheet"):
+        css_path = os.path.join(base_url, link.get("href", ""))
+        if os.path.isfile(css_path):
+            with open(css_path, "r") as f:
+                match = PAGE_MARGIN_RE.search(f.read())
+            if match:
+                return match.group(1).strip()
+    return "0"
+
+
+def with_first_page(section_html, first_page, margin):
+    if first_page == 1:
+        return section_html
+    style = "<style>" + SECTION_PAGE_STYLE.format(first_page=first_page, margin=margin) + "</style>"
+    return section_html.replace("</head>", f"{style}</head>", 1)
+
+
+def init_section_worker(parent_url_fetcher):
+    """ Pool initializer: fonts are configured once per worker, the fetcher's cache is the parent's copy """
+    global font_config, url_fetcher
+    font_config = FontConfiguration()
+    url_fetcher = parent_url_fetcher
+
+
+def render_section(section_html, base_url, first_page, margin):
+    """ Lays out one section starting at first_page, returns (PDF bytes, page count) """
+    html = weasyprint.HTML(string=with_first_page(section_html, first_page, margin), base_url=base_url,
+                           url_fetcher=url_fetcher or weasyprint.default_url_fetcher)
+    document = html.render(font_config=font_config, **PDF_OPTIONS)
+    return document.write_pdf(**PDF_OPTIONS), len(document.pages)
+
+
+def section_executor(max_workers, parent_url_fetcher=None):
+    """ One spawn pool reused by every report of this process, sized by the first caller """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=init_section_worker, initargs=(parent_url_fetcher,))
+        return executor
+
+
+def load_section_pages():
+    try:
+        with open(SECTION_PAGES_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_section_pages(section_pages):
+    os.makedirs(os.path.dirname(SECTION_PAGES_PATH), exist_ok=True)
+    atomic_write(SECTION_PAGES_PATH, json.dumps(section_pages))
+
+
+def first_pages(page_counts):
+    """ Page number each section starts on given every section's page count """
+    starts = []
+    page = 1
+    for count in page_counts:
+        starts.append(page)
+        page += count
+    return starts
+
+
+def write_pdf_sections(html_filename, pdf_filename, template, max_workers=None, url_fetcher=None):
+    """
+    Renders the report's <article> sections as separate documents in parallel and merges
+    them into pdf_filename, keeping page numbers continuous and each section's bookmarks.
+    Sections are laid out with start pages guessed from the previous render of the template,
+    any section whose guess turned out wrong is laid out again once all page counts are known.
+    The pool workers start with a copy of url_fetcher and keep their own font configuration.
+    """
+    with open(html_filename, "r") as f:
+        sections = split_sections(f.read())
+    base_url = os.path.dirname(os.path.abspath(html_filename)) + os.sep
+    margin = page_margin(sections[0][1], base_url) if sections else "0"
+
+    section_pages = load_section_pages()
+    known_pages = section_pages.get(template, {})
+    starts = first_pages([known_pages.get(section_id, 1) for section_id, _ in sections])
+
+    pool = section_executor(max_workers or os.cpu_count() or 1, url_fetcher)
+    futures = [pool.submit(render_section, section_html, base_url, start, margin)
+               for (_, section_html), start in zip(sections, starts)]
+    parts = [future.result() for future in futures]
+
+    actual_starts = first_pages([page_count for _, page_count in parts])
+    wrong = [i for i, (start, actual) in enumerate(zip(starts, actual_starts)) if start != actual]
+    if wrong:
+        print(f"Re-rendering {len(wrong)} of {len(sections)} sections with corrected page numbers")
+        futures = {i: pool.submit(render_section, sections[i][1], base_url, actual_starts[i], margin) for i in wrong}
+        for i, future in futures.items():
+            parts[i] = future.result()
+
+    writer = PdfWriter()
+    for pdf_bytes, _ in parts:
+        writer.append(PdfReader(io.BytesIO(pdf_bytes)), import_outline=True)
+    with open(pdf_filename, "wb") as f:
+        writer.write(f)
+
+    section_pages[template] = {section_id: page_count for (section_id, _), (_, page_count) in zip(sections, parts)}
+    save_section_pages(section_pages)
@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from report import load_report_stats
+from stellar_plots import StellarCyberPlots
+
+# Memory the app may hold in opened reports across all sessions, REPORT_CACHE_MB overrides it
+DEFAULT_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MB", 1024)) * 1024 * 1024
+
+
+def deep_size(value, seen=None):
+    """ Rough bytes held by collector results and plotly figure dicts """
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(deep_size(k, seen) + deep_size(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(deep_size(v, seen) for v in value)
+    return sys.getsizeof(value)
+
+
+def report_mtime(report_dir):
+    """ Changes whenever the report is regenerated: its stats manifest, or the .saved pickle of older reports """
+    for name in (os.path.join("stats", "manifest.json"), ".saved"):
+        file_path = os.path.join(report_dir, name)
+        if os.path.exists(file_path):
+            return os.path.getmtime(file_path)
+    raise FileNotFoundError(f"No saved stats in {report_dir}")
+
+
+class SharedReport():
+    """
+    The stats and plots of one opened report, shared read-only by every session that opens it.
+    One lock per report makes lazy stats loading and figure building happen once.
+    """
+
+    # Not collector results, left out of the size
+    UNSIZED_ATTRIBUTES = ('_store', '_lock', '_derived')
+
+    def __init__(self, report_dir):
+        self.lock = threading.RLock()  # Building a figure loads the stats it needs
+        self.sc_stats = load_report_stats(report_dir)
+        self.sc_stats.share(self.lock)
+        self.sc_plots = StellarCyberPlots(self.sc_stats, lock=self.lock)
+        self.sc_plots.on_build = self.add_figure
+        self.attribute_sizes = {}
+        self.figures_size = 0
+
+    def add_figure(self, fig_name, figure):
+        # Runs once per figure, right after it was built
+        self.figures_size += deep_size(figure.to_plotly_json())
+
+    def size(self):
+        """ Running total, stats attributes are sized once when first seen loaded """
+        # No lock: waiting here for another session's figure build would stall get()
+        for name, value in list(vars(self.sc_stats).items()):
+            if name not in self.attribute_sizes and name not in self.UNSIZED_ATTRIBUTES:
+                self.attribute_sizes[name] = deep_size(value)
+        return sum(self.attribute_sizes.values()) + self.figures_size
+
+
+class SharedReportCache():
+    """
+    Process wide LRU of opened reports keyed by report folder and stats mtime, so sessions
+    opening the same report share one copy of its stats and figures. Least recently opened
+    reports are dropped once the estimated total exceeds max_bytes; sessions still showing
+    them keep their reference until they open something else.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.reports = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}  # One lock per key so concurrent sessions load a report once
+
+    def get(self, report_dir):
+        key = (os.path.realpath(report_dir), report_mtime(report_dir))
+        with self.lock:
+            if key in self.reports:
+                self.reports.move_to_end(key)
+                report = self.reports[key]
+            else:
+                report = None
+                key_lock = self.loading.setdefault(key, threading.Lock())
+        if report is not None:
+            # Figures built since the last visit count towards the budget as well
+            self.evict()
+            return report
+
+        with key_lock:
+            with self.lock:
+                if key in self.reports:
+                    return self.reports[key]
+            try:
+                report = SharedReport(report_dir)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+            with self.lock:
+                # Older versions of a regenerated report can't be opened anymore
+                for stale in [k for k in self.reports if k[0] == key[0]]:
+                    del self.reports[stale]
+                self.reports[key] = report
+            self.evict()
+        return report
+
+    def evict(self):
+        """ Drops least recently used reports until within max_bytes, the newest one always stays """
+        with self.lock:
+            entries = list(self.reports.items())
+        sizes = {key: report.size() for key, report in entries}
+        total = sum(sizes.values())
+        with self.lock:
+            while len(self.reports) > 1 and total > self.max_bytes:
+                key, _ = self.reports.popitem(last=False)
+                total -= sizes.get(key, 0)
+                print(f"Evicted {key[0]} from the shared report cache")
@@ -0,0 +1,101 @@
+from helpers import gen_tenant_filter, gen_date_filter, gen_timeseries_aggs, gen_timeseries_query, \
+                    process_sensor_stats, search_daily
+from connector_stats import gen_connector_filter, gen_connector_aggs, process_connector_stats
+from log_source_stats import gen_log_source_filter, gen_log_source_aggs, process_log_source_stats
+from linux_sensor_stats import gen_linux_sensor_filter
+from windows_sensor_stats import gen_windows_sensor_filter
+from network_sensor_stats import gen_network_sensor_filter
+from security_sensor_stats import gen_security_sensor_filter, process_security_sensor_stats
+
+# Stats attribute -> (source filter, per day sub aggregations, counts unique sensors)
+ADE_SOURCES = {
+    'connector_stats': (gen_connector_filter, gen_connector_aggs, False),
+    'log_source_stats': (gen_log_source_filter, gen_log_source_aggs, False),
+    'linux_sensor_stats': (gen_linux_sensor_filter, gen_timeseries_aggs, True),
+    'windows_sensor_stats': (gen_windows_sensor_filter, gen_timeseries_aggs, True),
+    'network_sensor_stats': (gen_network_sensor_filter, gen_timeseries_aggs, True),
+    'security_sensor_stats': (gen_security_sensor_filter, lambda: gen_timeseries_aggs("security_sensor"), True),
+}
+
+
+def gen_ade_query_filter(start_date, end_date, tenant=None):
+    source_filter = {
+      "bool": {
+        "should": [gen_filter() for gen_filter, _, _ in ADE_SOURCES.values()],
+        "minimum_should_match": 1
+      }
+    }
+
+    if tenant:
+        return [gen_tenant_filter(tenant), source_filter, gen_date_filter(start_date, end_date)]
+    return [source_filter, gen_date_filter(start_date, end_date)]
+
+
+def gen_ade_fused_query(start_date, end_date, query_filter):
+    """
+    Single query covering every aella-ade-* collector.
+    Each day bucket holds one named filter aggregation per source, unique sensor
+    counts are top level filter + cardinality aggregations over the whole range.
+    """
+    source_aggs = {}
+    unique_count_aggs = {}
+    for name, (gen_filter, gen_aggs, unique_sensors) in ADE_SOURCES.items():
+        source_aggs[name] = {"filter": gen_filter(), "aggs": gen_aggs()}
+        if unique_sensors:
+            unique_count_aggs[name] = {
+              "filter": gen_filter(),
+              "aggs": {
+                "unique_sensors": {
+                  "cardinality": {
+                    "field": "engid.keyword"
+                  }
+                }
+              }
+            }
+
+    query = gen_timeseries_query(start_date, end_date, query_filter)
+    query["aggs"]["date"]["aggs"] = source_aggs
+    query["aggs"].update(unique_count_aggs)
+    return query
+
+
+def split_ade_response(response, name):
+    """ Rebuilds the response a standalone collector query would have returned for one source """
+    buckets = [{'key': b['key'], 'key_as_string': b['key_as_string'], **b[name]}
+               for b in response['aggregations']['date']['buckets']]
+    timeseries_response = {'aggregations': {'date': {'buckets': buckets}}}
+    unique_count_response = {'aggregations': response['aggregations'].get(name, {})}
+    return timeseries_response, unique_count_response
+
+
+def process_ade_stats(response):
+    ade_stats = {}
+    for name in ADE_SOURCES:
+        timeseries_response, unique_count_response = split_ade_response(response, name)
+        if name == 'connector_stats':
+            ade_stats[name] = process_connector_stats(timeseries_response)
+        elif name == 'log_source_stats':
+            ade_stats[name] = process_log_source_stats(timeseries_response)
+        elif name == 'security_sensor_stats':
+            ade_stats[name] = process_security_sensor_stats(timeseries_response, unique_count_response)
+        else:
+            ade_stats[name] = process_sensor_stats(timeseries_response, unique_count_response)
+    return ade_stats
+
+
+def ade_stats(api, start_date, end_date, tenant=None, org_id=None):
+    """
+    Stats: connector, log source and sensor volumes from one aella-ade-* request
+    Returns the same per collector dicts as the individual collectors, keyed by stats attribute.
+    """
+
+    if not org_id:
+        index = 'aella-ade-*'
+    else:
+        index = f"stellar-index-v1-ade-{org_id}-*"
+
+    def gen_query(start, end):
+        return gen_ade_fused_query(start, end, gen_ade_query_filter(start, end, tenant))
+
+    response = search_daily(api, 'ade_stats', index, gen_query, start_date, end_date, tenant)
+    return process_ade_stats(response)
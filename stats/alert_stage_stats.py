@@ -1,6 +1,6 @@
 import numpy as np
 from helpers import gen_tenant_filter, gen_date_filter, \
-                    gen_score_filter, gen_timeseries_query
+                    gen_score_filter, gen_timeseries_query, search_daily
 
 def alert_stage_stats(api, start_date, end_date, tenant=None, org_id=None):
     """
@@ -12,7 +12,6 @@ def alert_stage_stats(api, start_date, end_date, tenant=None, org_id=None):
         index = f"stellar-index-v1-ser-{org_id}-*"
 
     tenant_filter = gen_tenant_filter(tenant)
-    date_filter = gen_date_filter(start_date, end_date)
     score_filter = gen_score_filter("fidelity", "gte", 75)
 
     if tenant:
@@ -27,10 +26,10 @@ def alert_stage_stats(api, start_date, end_date, tenant=None, org_id=None):
     else:
       bool_filter = score_filter
 
-    query_filter = [bool_filter, date_filter]
-    query = gen_timeseries_query(start_date, end_date, query_filter, "xdr_killchain_stage")
+    def gen_query(start, end):
+        return gen_timeseries_query(start, end, [bool_filter, gen_date_filter(start, end)], "xdr_killchain_stage")
 
-    response = api.es_search(index, query)
+    response = search_daily(api, 'alert_stage_stats', index, gen_query, start_date, end_date, tenant)
     stage = ['Initial Attempts', 'Persistent Foothold', 'Exploration', 'Propagation', 'Exfiltration & Impact']
     stage_index = {'Initial Attempts': 0, 'Persistent Foothold': 1, 'Exploration': 2, 'Propagation': 3, 'Exfiltration & Impact': 4}
 
@@ -1,6 +1,6 @@
 import datetime
 from helpers import gen_tenant_filter, gen_date_filter, gen_base_count_query, \
-                    gen_score_filter, gen_top_query
+                    gen_score_filter, gen_top_query, search_daily
 
 def alert_stats(api, start_date, end_date, tenant=None, org_id=None):
     """
@@ -18,121 +18,54 @@ def alert_stats(api, start_date, end_date, tenant=None, org_id=None):
     else:
         index = f"stellar-index-v1-ser-{org_id}-*"
 
-    # All Alerts counts
-    tenant_filter = gen_tenant_filter(tenant)
-    date_filter = gen_date_filter(start_date, end_date)
-
-    if tenant:
-        query_filter = [tenant_filter, date_filter]
-    else:
-        query_filter = date_filter
-
-    base_count_query = gen_base_count_query(start_date, end_date, query_filter)
-
-    count_response = api.es_search(index, base_count_query)
-    for b in count_response['aggregations']['date']['buckets']:
-        alert_stats['count_per_day']['date'].append(b['key_as_string'][0:10])
-        alert_stats['count_per_day']['count'].append(b['doc_count'])
-    alert_stats['cumulative_alert_count'] = sum(alert_stats['count_per_day']['count'])
-
-    # Critical Alert counts
-    score_filter = gen_score_filter("event_score", "gte", 75)
-
-    if tenant:
-        bool_filter = {
-          "bool": {
-            "filter": [
-              tenant_filter,
-              score_filter
-            ]
+    def gen_query(start, end):
+        tenant_filter = gen_tenant_filter(tenant)
+        date_filter = gen_date_filter(start, end)
+
+        if tenant:
+            query_filter = [tenant_filter, date_filter]
+        else:
+            query_filter = date_filter
+
+        # Daily counts split into critical / high fidelity, unique alert types and top 3 in a single request
+        query = gen_top_query("event_score", query_filter)
+        query["aggs"] = gen_base_count_query(start, end, query_filter)["aggs"]
+        query["aggs"]["date"]["aggs"] = {
+          "score": {
+            "filters": {
+              "filters": {
+                "critical": gen_score_filter("event_score", "gte", 75),
+                "high_fidelity": gen_score_filter("fidelity", "gte", 75)
+              }
+            }
           }
         }
-    else:
-        bool_filter = score_filter
-
-    query_filter = [bool_filter, date_filter]
-
-    base_count_query = gen_base_count_query(start_date, end_date, query_filter)
-
-    critical_count_response = api.es_search(index, base_count_query)
-    for b in critical_count_response['aggregations']['date']['buckets']:
-        alert_stats['critical_count_per_day']['date'].append(b['key_as_string'][0:10])
-        alert_stats['critical_count_per_day']['count'].append(b['doc_count'])
-    alert_stats['cumulative_critical_alert_count'] = sum(alert_stats['critical_count_per_day']['count'])
-
-    # High Fidelity Alert counts
-    score_filter = gen_score_filter("fidelity", "gte", 75)
-
-    if tenant:
-      bool_filter = {
-        "bool": {
-          "filter": [
-            tenant_filter,
-            score_filter
-          ]
+        query["aggs"]["alert_type"] = {
+          "cardinality": {
+            "field": "xdr_event.name.keyword",
+            "precision_threshold": 10000
+          }
         }
-      }
-    else:
-      bool_filter = score_filter
+        return query
 
-    query_filter = [bool_filter, date_filter]
-
-    base_count_query = gen_base_count_query(start_date, end_date, query_filter)
-
-    critical_count_response = api.es_search(index, base_count_query)
-    for b in critical_count_response['aggregations']['date']['buckets']:
-      alert_stats['high_fidelity_count_per_day']['date'].append(b['key_as_string'][0:10])
-      alert_stats['high_fidelity_count_per_day']['count'].append(b['doc_count'])
+    response = search_daily(api, 'alert_stats', index, gen_query, start_date, end_date, tenant)
+    for b in response['aggregations']['date']['buckets']:
+        date = b['key_as_string'][0:10]
+        alert_stats['count_per_day']['date'].append(date)
+        alert_stats['count_per_day']['count'].append(b['doc_count'])
+        alert_stats['critical_count_per_day']['date'].append(date)
+        alert_stats['critical_count_per_day']['count'].append(b['score']['buckets']['critical']['doc_count'])
+        alert_stats['high_fidelity_count_per_day']['date'].append(date)
+        alert_stats['high_fidelity_count_per_day']['count'].append(b['score']['buckets']['high_fidelity']['doc_count'])
+    alert_stats['cumulative_alert_count'] = sum(alert_stats['count_per_day']['count'])
+    alert_stats['cumulative_critical_alert_count'] = sum(alert_stats['critical_count_per_day']['count'])
     alert_stats['cumulative_high_fidelity_alert_count'] = sum(alert_stats['high_fidelity_count_per_day']['count'])
 
     # Unique alert type count
-    tenant_filter = gen_tenant_filter(tenant)
-    date_filter = gen_date_filter(start_date, end_date)
-
-    if tenant:
-      query_filter = [tenant_filter, date_filter]
-    else:
-      query_filter = date_filter
-
-    base_count_query = {
-      "aggs": {
-        "alert_type": {
-          "terms": {
-            "field": "xdr_event.name.keyword",
-            "order": {
-              "_count": "desc"
-            },
-            "size": 10000
-          }
-        }
-      },
-      "size": 0,
-      "query": {
-        "bool": {
-          "must": [],
-          "filter": query_filter,
-          "should": [],
-          "must_not": []
-        }
-      }
-    }
-
-    count_response = api.es_search(index, base_count_query)
-    alert_stats['unique_alert_type_count'] = len(count_response['aggregations']['alert_type']['buckets'])
+    alert_stats['unique_alert_type_count'] = response['aggregations']['alert_type']['value']
 
     # Top 3 by score
-    tenant_filter = gen_tenant_filter(tenant)
-    date_filter = gen_date_filter(start_date, end_date)
-
-    if tenant:
-      query_filter = [tenant_filter, date_filter]
-    else:
-      query_filter = date_filter
-
-    top_query = gen_top_query("event_score", query_filter)
-
-    top_response = api.es_search(index, top_query)
-    for h in top_response['hits']['hits']:
+    for h in response['hits']['hits']:
       record = {
         'datetime': datetime.datetime.fromtimestamp(h['_source']['timestamp']//1000).strftime('%c'),
         'xdr_event.display_name': h['_source']['xdr_event']['display_name'],
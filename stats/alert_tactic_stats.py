@@ -1,6 +1,6 @@
 import numpy as np
 from helpers import gen_tenant_filter, gen_date_filter, \
-                    gen_score_filter, gen_timeseries_query
+                    gen_score_filter, gen_timeseries_query, search_daily
 
 def alert_tactic_stats(api, start_date, end_date, tenant=None, org_id=None):
     """
@@ -13,7 +13,6 @@ def alert_tactic_stats(api, start_date, end_date, tenant=None, org_id=None):
         index = f"stellar-index-v1-ser-{org_id}-*"
 
     tenant_filter = gen_tenant_filter(tenant)
-    date_filter = gen_date_filter(start_date, end_date)
     score_filter = gen_score_filter("fidelity", "gte", 75)
 
     if tenant:
@@ -28,11 +27,10 @@ def alert_tactic_stats(api, start_date, end_date, tenant=None, org_id=None):
     else:
       bool_filter = score_filter
 
-    query_filter = [bool_filter, date_filter]
+    def gen_query(start, end):
+        return gen_timeseries_query(start, end, [bool_filter, gen_date_filter(start, end)], "alert_tactic")
 
-    query = gen_timeseries_query(start_date, end_date, query_filter, "alert_tactic")
-
-    response = api.es_search(index, query)
+    response = search_daily(api, 'alert_tactic_stats', index, gen_query, start_date, end_date, tenant)
 
     stage_tactic_counts = {'Initial Attempts': {}, 'Persistent Foothold': {}, 'Exploration': {}, 'Propagation': {}, 'Exfiltration & Impact': {}}
     stage_tactic_list = [[], []]
@@ -1,6 +1,6 @@
 from collections import OrderedDict
 import statistics
-from helpers import gen_tenant_filter, gen_date_filter
+from helpers import gen_tenant_filter, gen_date_filter, search_daily
 import acgs
 
 def asset_stats(api, start_date, end_date, daily_date_scale, tenant=None, org_id=None):
@@ -29,41 +29,44 @@ def asset_stats(api, start_date, end_date, daily_date_scale, tenant=None, org_id
         asset_stats['assets_per_day']['count'] = list(asset_data.values())
     else:
         index = 'aella-assetlicense-1'
-        query_filter = [gen_tenant_filter(tenant), gen_date_filter(start_date, end_date)]
 
-        query = {
-          "aggs": {
-            "date": {
-              "date_histogram": {
-                "field": "timestamp",
-                "calendar_interval": "1d",
-                "min_doc_count": 0,
-                "extended_bounds": {
-                  "min": start_date,
-                  "max": end_date
-                }
-              },
+        def gen_query(start, end):
+            query_filter = [gen_tenant_filter(tenant), gen_date_filter(start, end)]
+
+            query = {
               "aggs": {
-                "asset_count": {
-                  "sum": {
-                    "field": "asset_usage"
+                "date": {
+                  "date_histogram": {
+                    "field": "timestamp",
+                    "calendar_interval": "1d",
+                    "min_doc_count": 0,
+                    "extended_bounds": {
+                      "min": start,
+                      "max": end
+                    }
+                  },
+                  "aggs": {
+                    "asset_count": {
+                      "sum": {
+                        "field": "asset_usage"
+                      }
+                    }
                   }
                 }
+              },
+              "size": 0,
+              "query": {
+                "bool": {
+                  "must": [],
+                  "filter": query_filter,
+                  "should": [],
+                  "must_not": []
+                }
               }
             }
-          },
-          "size": 0,
-          "query": {
-            "bool": {
-              "must": [],
-              "filter": query_filter,
-              "should": [],
-              "must_not": []
-            }
-          }
-        }
+            return query
 
-        response = api.es_search(index, query)
+        response = search_daily(api, 'asset_stats', index, gen_query, start_date, end_date, tenant)
         # for b in response['aggregations']['date']['buckets']:
         for b in response.get('aggregations', {}).get('date', {}).get('buckets', {}):
           asset_stats['assets_per_day']['date'].append(b['key_as_string'][0:10])
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+from query_cache import CACHE_DIR
+
+BUCKET_STORE_PATH = os.path.join(CACHE_DIR, "buckets.sqlite")
+
+
+class DailyBucketStore():
+    """
+    Persistent store of daily date_histogram buckets keyed by (host, tenant, metric, day).
+    Only complete days (before today in UTC) are stored, so stored buckets never change.
+    """
+
+    def __init__(self, path=BUCKET_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    host TEXT, tenant TEXT, metric TEXT, day TEXT, bucket TEXT,
+                    PRIMARY KEY (host, tenant, metric, day)
+                )
+            """)
+
+    def connect(self):
+        # One connection per call keeps the store usable from collector threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def metric_key(metric, index, query):
+        """ Metric name plus a hash of the query shape, so changed queries don't reuse old buckets """
+        canonical = json.dumps([index, query], sort_keys=True, separators=(',', ':'))
+        return f"{metric}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()[0:16]}"
+
+    @staticmethod
+    def is_complete(day):
+        return day < datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    def get(self, host, tenant, metric, days):
+        if not days:
+            return {}
+        with closing(self.connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT day, bucket FROM buckets WHERE host = ? AND tenant = ? AND metric = ? AND day BETWEEN ? AND ?",
+                (host, tenant, metric, min(days), max(days))
+            ).fetchall()
+        return {day: json.loads(bucket) for day, bucket in rows if day in days}
+
+    def put(self, host, tenant, metric, buckets):
+        rows = [(host, tenant, metric, day, json.dumps(bucket)) for day, bucket in buckets.items() if self.is_complete(day)]
+        if not rows:
+            return
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)", rows)
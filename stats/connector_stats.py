@@ -1,4 +1,28 @@
-from helpers import gen_tenant_filter, gen_date_filter, gen_msgtype_filter
+from helpers import gen_tenant_filter, gen_date_filter, gen_msgtype_filter, search_daily
+
+def gen_connector_filter():
+    return gen_msgtype_filter(40)
+
+def gen_connector_aggs():
+    connector_aggs = {
+      "connector_name": {
+        "terms": {
+          "field": "msg_origin.source.keyword",
+          "order": {
+            "out_bytes_delta_total": "desc"
+          },
+          "size": 1000
+        },
+        "aggs": {
+          "out_bytes_delta_total": {
+            "sum": {
+              "field": "out_bytes_delta"
+            }
+          }
+        }
+      }
+    }
+    return connector_aggs
 
 def connector_stats(api, start_date, end_date, tenant=None, org_id=None):
     """
@@ -11,7 +35,7 @@ def connector_stats(api, start_date, end_date, tenant=None, org_id=None):
     else:
         index = f"stellar-index-v1-ade-{org_id}-*"
 
-    msgtype_filter = gen_msgtype_filter(40)
+    msgtype_filter = gen_connector_filter()
 
     if tenant:
       bool_filter = {
@@ -25,53 +49,41 @@ def connector_stats(api, start_date, end_date, tenant=None, org_id=None):
     else:
       bool_filter = msgtype_filter
 
-    query_filter = [bool_filter, gen_date_filter(start_date, end_date)]
+    def gen_query(start, end):
+        query_filter = [bool_filter, gen_date_filter(start, end)]
 
-    query = {
-      "aggs": {
-        "date": {
-          "date_histogram": {
-            "field": "timestamp",
-            "calendar_interval": "1d",
-            "time_zone": "+00:00",
-            "min_doc_count": 0,
-            "extended_bounds": {
-              "min": start_date,
-              "max": end_date
-            }
-          },
+        query = {
           "aggs": {
-            "connector_name": {
-              "terms": {
-                "field": "msg_origin.source.keyword",
-                "order": {
-                  "out_bytes_delta_total": "desc"
-                },
-                "size": 1000
-              },
-              "aggs": {
-                "out_bytes_delta_total": {
-                  "sum": {
-                    "field": "out_bytes_delta"
-                  }
+            "date": {
+              "date_histogram": {
+                "field": "timestamp",
+                "calendar_interval": "1d",
+                "time_zone": "+00:00",
+                "min_doc_count": 0,
+                "extended_bounds": {
+                  "min": start,
+                  "max": end
                 }
-              }
+              },
+              "aggs": gen_connector_aggs()
+            }
+          },
+          "size": 0,
+          "query": {
+            "bool": {
+              "must": [],
+              "filter": query_filter,
+              "should": [],
+              "must_not": []
             }
           }
         }
-      },
-      "size": 0,
-      "query": {
-        "bool": {
-          "must": [],
-          "filter": query_filter,
-          "should": [],
-          "must_not": []
-        }
-      }
-    }
+        return query
+
+    response = search_daily(api, 'connector_stats', index, gen_query, start_date, end_date, tenant)
+    return process_connector_stats(response)
 
-    response = api.es_search(index, query)
+def process_connector_stats(response):
     connector_stats = {'daily_volume_by_connector': {'date': [], 'connector_name': [], 'volume': []},
                     'cumulative_volume_by_connector': {'connector_name': [], 'volume': []},
                     'volume_per_day': {'date': [], 'volume': []},
@@ -1,4 +1,5 @@
 import acgs
+from datetime import datetime, timedelta
 
 
 def gen_unique_count_query(query_filter):    
@@ -161,7 +162,7 @@ def gen_sensor_type_filter(sensor_type):
     }
     return sensor_type_filter
 
-def gen_timeseries_query(start_date, end_date, query_filter, agg_type=None):
+def gen_timeseries_aggs(agg_type=None):
     if agg_type == "security_sensor":
         aggs = {
             "feature": {
@@ -221,6 +222,11 @@ def gen_timeseries_query(start_date, end_date, query_filter, agg_type=None):
             }
           }
 
+    return aggs
+
+def gen_timeseries_query(start_date, end_date, query_filter, agg_type=None):
+    aggs = gen_timeseries_aggs(agg_type)
+
     timeseries_query = {
       "aggs": {
         "date": {
@@ -313,3 +319,59 @@ def gen_top_query(field, query_filter):
     }
     return top_query
 
+
+def gen_daily_date_scale(start_date, end_date):
+    start = datetime.strptime(start_date[0:10], '%Y-%m-%d')
+    end = datetime.strptime(end_date[0:10], '%Y-%m-%d')
+    return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+def search_daily(api, metric, index, gen_query, start_date, end_date, tenant=None):
+    """
+    Runs a query whose "date" aggregation is a daily date_histogram, serving complete days
+    from api.bucket_store and only querying ES for the days not stored yet.
+    gen_query(start, end) builds the query for a date range. Any other aggregations or hits
+    cover the whole range and are fetched by a separate query without the histogram.
+    """
+    store = getattr(api, 'bucket_store', None)
+    query = gen_query(start_date, end_date)
+    if store is None:
+        return api.es_search(index, query)
+
+    host = api.api_baseurl
+    tenant = tenant or "All Tenants"
+    metric = store.metric_key(metric, index, gen_query("1970-01-01", "1970-01-01"))
+    days = gen_daily_date_scale(start_date, end_date)
+    stored = store.get(host, tenant, metric, days)
+    missing = [d for d in days if d not in stored]
+
+    if len(missing) == len(days):
+        response = api.es_search(index, query)
+        if response:
+            store.put(host, tenant, metric, {b['key_as_string'][0:10]: b for b in response['aggregations']['date']['buckets']})
+        return response
+
+    # Whole range aggregations (cardinality, top hits, ...) can't be stitched from days
+    response = {}
+    range_query = dict(query, aggs={k: v for k, v in query.get('aggs', {}).items() if k != 'date'})
+    if range_query['aggs'] or range_query.get('size', 0):
+        response = api.es_search(index, range_query)
+        if not response:
+            return response
+
+    buckets = dict(stored)
+    if missing:
+        print(f"{metric}: {len(days) - len(missing)} stored days, querying {missing[0]} to {missing[-1]}")
+        # Only the histogram, the whole range aggregations and hits came with range_query
+        missing_query = gen_query(missing[0], missing[-1])
+        missing_query = dict(missing_query, aggs={'date': missing_query['aggs']['date']}, size=0)
+        missing_response = api.es_search(index, missing_query)
+        if not missing_response:
+            return missing_response
+        fresh = {b['key_as_string'][0:10]: b for b in missing_response['aggregations']['date']['buckets']}
+        store.put(host, tenant, metric, fresh)
+        buckets.update({d: b for d, b in fresh.items() if d in missing})
+
+    merged = dict(response)
+    merged['aggregations'] = dict(response.get('aggregations', {}))
+    merged['aggregations']['date'] = {'buckets': [buckets[d] for d in days if d in buckets]}
+    return merged
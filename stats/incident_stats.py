@@ -1,22 +1,110 @@
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 
 COLUMNS = ['_id', 'created_at', 'name', 'tags', 'severity', 'score', 'assignee_name']
+COLUMN_DTYPES = {'created_at': 'int64', 'score': 'float64'}
+CATEGORICAL_COLUMNS = ['severity', 'assignee_name']
+CASES_PAGE_SIZE = 500
+# Time slices of the case window streamed concurrently
+CASES_MAX_IN_FLIGHT = 4
 
 
-def get_incidents(api, start, end):
-    response = api.rest_search(
-        'v1/cases',
-        {
-            'FROM~created_at': int(start.timestamp() * 1000),
-            'TO~created_at': int(end.timestamp() * 1000),
-            'FROM~score': 50,
-        }
-    )
-    df = pd.DataFrame(
-        columns=COLUMNS,
-        data=[[i[c] for c in COLUMNS] for i in response['data']['cases']]
-    )
+class CaseBuffers():
+    """
+    Preallocated per column buffers that case pages are copied into,
+    so only one page of case dicts per stream is alive at a time.
+    """
+
+    def __init__(self, capacity):
+        self.rows = 0
+        self.lock = threading.Lock()
+        self.columns = {c: np.empty(max(capacity, 1), dtype=COLUMN_DTYPES.get(c, object)) for c in COLUMNS}
+
+    def append(self, cases):
+        with self.lock:
+            start = self.rows
+            end = start + len(cases)
+            if end > len(self.columns['_id']):
+                # More cases than counted up front (window still open), grow geometrically
+                capacity = max(end, 2 * len(self.columns['_id']))
+                self.columns = {c: np.resize(buffer, capacity) for c, buffer in self.columns.items()}
+            for c in COLUMNS:
+                self.columns[c][start:end] = [i.get(c) for i in cases]
+            self.rows = end
+
+    def to_df(self):
+        df = pd.DataFrame({c: buffer[:self.rows] for c, buffer in self.columns.items()})
+        for c in CATEGORICAL_COLUMNS:
+            df[c] = df[c].astype('category')
+        return df.sort_values('created_at', kind='stable').reset_index(drop=True)
+
+
+def iter_case_pages(api, params, start_ms, end_ms, page_size=CASES_PAGE_SIZE):
+    """
+    Streams v1/cases created in [start_ms, end_ms] page by page, using created_at as the cursor
+    """
+    cursor = start_ms
+    skip = 0
+    boundary_ids = set()
+    while True:
+        response = api.rest_search('v1/cases', {
+            **params,
+            'FROM~created_at': cursor,
+            'TO~created_at': end_ms,
+            'sort': 'created_at',
+            'order': 'asc',
+            'skip': skip,
+            'limit': page_size
+        })
+        cases = response['data']['cases']
+        new_cases = [i for i in cases if i['_id'] not in boundary_ids]
+        if new_cases:
+            yield new_cases
+
+        if len(cases) < page_size:
+            break
+
+        last = cases[-1]['created_at']
+        if last == cursor:
+            # Whole page shares the cursor timestamp, page through it by offset
+            skip += len(cases)
+        else:
+            # Cases sharing the last timestamp are returned again by the next page
+            cursor, skip = last, 0
+            boundary_ids = {i['_id'] for i in cases if i['created_at'] == last}
+
+
+def get_incidents(api, start, end, cust_id=None, page_size=CASES_PAGE_SIZE, max_in_flight=CASES_MAX_IN_FLIGHT):
+    """
+    All cases with score >= 50 created between start and end.
+    With max_in_flight > 1 the window is split in time slices streamed concurrently.
+    """
+    params = {'FROM~score': 50}
+    if cust_id:
+        params['cust_id'] = cust_id
+    start_ms = int(start.timestamp() * 1000)
+    end_ms = int(end.timestamp() * 1000)
+
+    total = api.rest_search('v1/cases', {**params, 'FROM~created_at': start_ms, 'TO~created_at': end_ms, 'limit': 1})
+    buffers = CaseBuffers(total['data']['total'])
+
+    def stream(slice_start, slice_end):
+        for cases in iter_case_pages(api, params, slice_start, slice_end, page_size):
+            buffers.append(cases)
+
+    if max_in_flight > 1:
+        bounds = np.linspace(start_ms, end_ms + 1, max_in_flight + 1).astype('int64')
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            futures = [executor.submit(stream, bounds[i], bounds[i + 1] - 1) for i in range(max_in_flight)]
+            for future in futures:
+                future.result()
+    else:
+        stream(start_ms, end_ms)
+
+    df = buffers.to_df()
     df['Date'] = df.created_at.astype('datetime64[ms]').dt.date
     df['Is_Critical'] = df.score >= 75
     return df
@@ -31,7 +119,12 @@ def get_case_summaries(api, incidents_df):
     return incidents_df
 
 
-def get_incident_stats(api, daily_date_scale, tenant):
+def count_per_day(day_index, mask, day_count):
+    """ Number of cases per day for the rows selected by mask """
+    return pd.Series(day_index[mask]).value_counts().reindex(range(day_count), fill_value=0).tolist()
+
+
+def get_incident_stats(api, daily_date_scale, tenant, max_in_flight=CASES_MAX_IN_FLIGHT):
     """
     Critical incidents per day, total critical incidents, top 3 incidents by risk score
     """
@@ -45,50 +138,30 @@ def get_incident_stats(api, daily_date_scale, tenant):
             'cumulative_critical_incident_count': 0
         }
 
-        if tenant:
-            cust_id = api.tenant_info[tenant].get("cust_id")
-
-        daily_dfs = []
-        for d in daily_date_scale:
-            query_date_start = datetime.datetime.strptime(d, "%Y-%m-%d")
-            query_date_end = query_date_start + datetime.timedelta(days=1, milliseconds=-1)
-
-            query_params = {
-                'FROM~created_at': int(query_date_start.timestamp() * 1000),
-                'TO~created_at': int(query_date_end.timestamp() * 1000),
-                'limit': 1,
-                'FROM~score': 75
-            }
-            if tenant:
-                query_params['cust_id'] = cust_id
+        cust_id = api.tenant_info[tenant].get("cust_id") if tenant else None
 
-            response = api.rest_search('v1/cases', query_params)
+        day_starts = [datetime.datetime.strptime(d, "%Y-%m-%d") for d in daily_date_scale]
+        query_date_start = day_starts[0]
+        query_date_end = day_starts[-1] + datetime.timedelta(days=1, milliseconds=-1)
 
-            incident_stats['critical_count_per_day']['date'].append(d)
-            incident_stats['critical_count_per_day']['count'].append(response['data']['total'])
+        # All cases with score >= 50 over the whole window, paginated
+        df = get_incidents(api, query_date_start, query_date_end, cust_id, max_in_flight=max_in_flight)
 
-            query_params = {
-                'FROM~created_at': int(query_date_start.timestamp() * 1000),
-                'TO~created_at': int(query_date_end.timestamp() * 1000),
-                'limit': 1,
-                'FROM~score': 50,
-                'TO~score': 74.99999
-            }
-            if tenant:
-                query_params['cust_id'] = cust_id
+        # Bucket cases into the same local day windows the per day queries used
+        day_bounds = [int(d.timestamp() * 1000) for d in day_starts] + [int(query_date_end.timestamp() * 1000) + 1]
+        created_at = df.created_at.to_numpy(dtype='int64')
+        day_index = np.searchsorted(day_bounds, created_at, side='right') - 1
+        score = df.score.to_numpy(dtype='float64')
+        in_range = (day_index >= 0) & (day_index < len(day_starts))
 
-            response = api.rest_search('v1/cases', query_params)
-
-            incident_stats['high_count_per_day']['date'].append(d)
-            incident_stats['high_count_per_day']['count'].append(response['data']['total'])
-
-            daily_dfs.append(get_incidents(api, query_date_start, query_date_end))
+        incident_stats['critical_count_per_day']['date'] = list(daily_date_scale)
+        incident_stats['critical_count_per_day']['count'] = count_per_day(
+            day_index, in_range & (score >= 75), len(day_starts))
+        incident_stats['high_count_per_day']['date'] = list(daily_date_scale)
+        incident_stats['high_count_per_day']['count'] = count_per_day(
+            day_index, in_range & (score >= 50) & (score <= 74.99999), len(day_starts))
 
         # Top 3 by risk
-        query_date_start = datetime.datetime.strptime(daily_date_scale[0], "%Y-%m-%d")
-        query_date_end = datetime.datetime.strptime(daily_date_scale[-1], "%Y-%m-%d")
-        query_date_end = query_date_end + datetime.timedelta(days=1, milliseconds=-1)
-
         query_params = {
             'FROM~created_at': int(query_date_start.timestamp() * 1000),
             'TO~created_at': int(query_date_end.timestamp() * 1000),
@@ -113,7 +186,6 @@ def get_incident_stats(api, daily_date_scale, tenant):
         incident_stats['cumulative_critical_incident_count'] = sum(incident_stats['critical_count_per_day']['count'])
         # print(json.dumps(incident_stats, indent=3))
 
-        df = pd.concat(daily_dfs)
         # df = get_case_summaries(api, df)
         incident_stats['incidents_df'] = df
         incident_stats['high_incident_count'] = sum(incident_stats['high_count_per_day']['count'])
@@ -124,4 +196,3 @@ def get_incident_stats(api, daily_date_scale, tenant):
         # exit(0)
 
     return incident_stats
-
@@ -1,4 +1,28 @@
-from helpers import gen_tenant_filter, gen_date_filter, gen_msgtype_filter
+from helpers import gen_tenant_filter, gen_date_filter, gen_msgtype_filter, search_daily
+
+def gen_log_source_filter():
+    return gen_msgtype_filter(39)
+
+def gen_log_source_aggs():
+    log_source_aggs = {
+      "log_source": {
+        "terms": {
+          "field": "stage_output.msg_origin_source.keyword",
+          "order": {
+            "out_bytes_delta_total": "desc"
+          },
+          "size": 1000
+        },
+        "aggs": {
+          "out_bytes_delta_total": {
+            "sum": {
+              "field": "stage_output.stats.bytes"
+            }
+          }
+        }
+      }
+    }
+    return log_source_aggs
 
 def log_source_stats(api, start_date, end_date, tenant=None, org_id=None):
     """
@@ -12,7 +36,7 @@ def log_source_stats(api, start_date, end_date, tenant=None, org_id=None):
         index = f"stellar-index-v1-ade-{org_id}-*"
 
 
-    msgtype_filter = gen_msgtype_filter(39)
+    msgtype_filter = gen_log_source_filter()
 
     if tenant:
       bool_filter = {
@@ -26,53 +50,41 @@ def log_source_stats(api, start_date, end_date, tenant=None, org_id=None):
     else:
       bool_filter = msgtype_filter
 
-    query_filter = [bool_filter, gen_date_filter(start_date, end_date)]
-
-    query = {
-      "aggs": {
-        "date": {
-          "date_histogram": {
-            "field": "timestamp",
-            "calendar_interval": "1d",
-            "time_zone": "+00:00",
-            "min_doc_count": 0,
-            "extended_bounds": {
-              "min": start_date,
-              "max": end_date
-            }
-          },
+    def gen_query(start, end):
+        query_filter = [bool_filter, gen_date_filter(start, end)]
+
+        query = {
           "aggs": {
-            "log_source": {
-              "terms": {
-                "field": "stage_output.msg_origin_source.keyword",
-                "order": {
-                  "out_bytes_delta_total": "desc"
-                },
-                "size": 1000
-              },
-              "aggs": {
-                "out_bytes_delta_total": {
-                  "sum": {
-                    "field": "stage_output.stats.bytes"
-                  }
+            "date": {
+              "date_histogram": {
+                "field": "timestamp",
+                "calendar_interval": "1d",
+                "time_zone": "+00:00",
+                "min_doc_count": 0,
+                "extended_bounds": {
+                  "min": start,
+                  "max": end
                 }
-              }
+              },
+              "aggs": gen_log_source_aggs()
+            }
+          },
+          "size": 0,
+          "query": {
+            "bool": {
+              "must": [],
+              "filter": query_filter,
+              "should": [],
+              "must_not": []
             }
           }
         }
-      },
-      "size": 0,
-      "query": {
-        "bool": {
-          "must": [],
-          "filter": query_filter,
-          "should": [],
-          "must_not": []
-        }
-      }
-    }
+        return query
+
+    response = search_daily(api, 'log_source_stats', index, gen_query, start_date, end_date, tenant)
+    return process_log_source_stats(response)
 
-    response = api.es_search(index, query)
+def process_log_source_stats(response):
     log_source_stats = {'daily_volume_by_log_source': {'date': [], 'log_source': [], 'volume': []},
                     'cumulative_volume_by_log_source': {'log_source': [], 'volume': []},
                     'volume_per_day': {'date': [], 'volume': []},
@@ -1,5 +1,16 @@
 from helpers import gen_tenant_filter, gen_date_filter, gen_msgtype_filter, gen_sensor_type_filter, \
-                    gen_timeseries_query, gen_unique_count_query, process_sensor_stats
+                    gen_timeseries_query, gen_unique_count_query, process_sensor_stats, search_daily
+
+def gen_network_sensor_filter():
+    network_sensor_filter = {
+      "bool": {
+        "filter": [
+          gen_sensor_type_filter("device"),
+          gen_msgtype_filter(37)
+        ]
+      }
+    }
+    return network_sensor_filter
 
 def network_sensor_stats(api, start_date, end_date, tenant=None, org_id=None):
     """
@@ -13,36 +24,26 @@ def network_sensor_stats(api, start_date, end_date, tenant=None, org_id=None):
         index = f"stellar-index-v1-ade-{org_id}-*"
 
     tenant_filter = gen_tenant_filter(tenant)
-    sensor_type_filter = gen_sensor_type_filter("device") 
-    msgtype_filter = gen_msgtype_filter(37)
+    sensor_filter = gen_network_sensor_filter()
     date_filter = gen_date_filter(start_date, end_date)
 
     if tenant:
       bool_filter = {
         "bool": {
-          "filter": [
-            tenant_filter,
-            sensor_type_filter,
-            msgtype_filter
-          ]
+          "filter": [tenant_filter] + sensor_filter["bool"]["filter"]
         }
       }
     else:
-      bool_filter = {
-        "bool": {
-          "filter": [
-            sensor_type_filter,
-            msgtype_filter
-          ]
-        }
-      }
+      bool_filter = sensor_filter
 
     query_filter = [bool_filter, date_filter]
 
-    timeseries_query = gen_timeseries_query(start_date, end_date, query_filter)
+    def gen_query(start, end):
+        return gen_timeseries_query(start, end, [bool_filter, gen_date_filter(start, end)])
+
     unique_count_query = gen_unique_count_query(query_filter)
 
-    response = api.es_search(index, timeseries_query)
+    response = search_daily(api, 'network_sensor_stats', index, gen_query, start_date, end_date, tenant)
     unique_count_response = api.es_search(index, unique_count_query)
 
     network_sensor_stats = process_sensor_stats(response, unique_count_response)
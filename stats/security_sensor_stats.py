@@ -1,19 +1,7 @@
 from helpers import gen_tenant_filter, gen_date_filter, gen_msgtypes_filter, gen_sensor_type_filter, \
-                    gen_timeseries_query, gen_unique_count_query, process_sensor_stats
-
-def security_sensor_stats(api, start_date, end_date, tenant=None, org_id=None):
-    """
-    Stats: (Flow and IDS & MW) cumulative volume for all security sensors, daily volume timeseries
-    Gets stats bucketed by day in UTC.
-    """
-
-    if not org_id:
-        index = 'aella-ade-*'
-    else:
-        index = f"stellar-index-v1-ade-{org_id}-*"
-
-    tenant_filter = gen_tenant_filter(tenant)
+                    gen_timeseries_query, gen_unique_count_query, process_sensor_stats, search_daily
 
+def gen_security_sensor_filter():
     sensor_type_filter = {
       "bool": {
         "should": [
@@ -27,38 +15,53 @@ def security_sensor_stats(api, start_date, end_date, tenant=None, org_id=None):
       }
     }
 
-    msgtype_filter = gen_msgtypes_filter([37, 33])
+    security_sensor_filter = {
+      "bool": {
+        "filter": [
+          sensor_type_filter,
+          gen_msgtypes_filter([37, 33])
+        ]
+      }
+    }
+    return security_sensor_filter
+
+def security_sensor_stats(api, start_date, end_date, tenant=None, org_id=None):
+    """
+    Stats: (Flow and IDS & MW) cumulative volume for all security sensors, daily volume timeseries
+    Gets stats bucketed by day in UTC.
+    """
 
+    if not org_id:
+        index = 'aella-ade-*'
+    else:
+        index = f"stellar-index-v1-ade-{org_id}-*"
+
+    tenant_filter = gen_tenant_filter(tenant)
+    sensor_filter = gen_security_sensor_filter()
     date_filter = gen_date_filter(start_date, end_date)
 
     if tenant:
       bool_filter = {
         "bool": {
-          "filter": [
-            tenant_filter,
-            sensor_type_filter,
-            msgtype_filter
-          ]
+          "filter": [tenant_filter] + sensor_filter["bool"]["filter"]
         }
       }
     else:
-      bool_filter = {
-        "bool": {
-          "filter": [
-            sensor_type_filter,
-            msgtype_filter
-          ]
-        }
-      }
+      bool_filter = sensor_filter
 
     query_filter = [bool_filter, date_filter]
 
-    timeseries_query = gen_timeseries_query(start_date, end_date, query_filter, "security_sensor")
+    def gen_query(start, end):
+        return gen_timeseries_query(start, end, [bool_filter, gen_date_filter(start, end)], "security_sensor")
+
     unique_count_query = gen_unique_count_query(query_filter)
 
-    response = api.es_search(index, timeseries_query)
+    response = search_daily(api, 'security_sensor_stats', index, gen_query, start_date, end_date, tenant)
     unique_count_response = api.es_search(index, unique_count_query)
 
+    return process_security_sensor_stats(response, unique_count_response)
+
+def process_security_sensor_stats(response, unique_count_response):
     security_sensor_stats = {'daily_volume_by_feature': {'date': [], 'feature': [], 'volume': []},
                     'cumulative_volume_by_feature': {'feature': [], 'volume': []},
                     'volume_per_day': {'date': [], 'volume': []},
@@ -0,0 +1,117 @@
+import json
+import threading
+from collections import defaultdict
+
+TENANT_FIELD = "tenant_name"  # As gen_tenant_filter matches it
+TENANT_KEYWORD_FIELD = "tenant_name.keyword"  # Exact values for the terms filter and split
+TENANT_PLACEHOLDER = "__tenant__"
+
+
+def match_tenant_filter(node):
+    """ Tenant name if node is a filter made by helpers.gen_tenant_filter, else None """
+    bool_query = node.get("bool")
+    if not isinstance(bool_query, dict):
+        return None
+    should = bool_query.get("should")
+    if not isinstance(should, list) or len(should) != 1 or not isinstance(should[0], dict):
+        return None
+    match_phrase = should[0].get("match_phrase")
+    if len(should[0]) != 1 or not isinstance(match_phrase, dict) or list(match_phrase) != [TENANT_FIELD]:
+        return None
+    return match_phrase[TENANT_FIELD]
+
+
+class TenantFanoutAPI():
+    """
+    Wraps a StellarCyberAPI for a batch of tenants. The first ES query of a given shape is
+    sent once for every tenant with a terms split on tenant_name.keyword, the response is sliced
+    per tenant and the other tenants' identical queries are answered from it.
+    Everything else (REST calls, tenant_info, caches) goes to the wrapped API.
+    """
+
+    def __init__(self, api, tenants):
+        self.api = api
+        self.tenants = [t for t in tenants if t and t != "All Tenants"]
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.shape_locks = defaultdict(threading.Lock)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def normalize(self, node, found):
+        """ Copy of node with batch tenant filters replaced by a placeholder, tenants collected in found """
+        if isinstance(node, dict):
+            tenant = match_tenant_filter(node)
+            if tenant in self.tenants:
+                found.add(tenant)
+                return TENANT_PLACEHOLDER
+            return {k: self.normalize(v, found) for k, v in node.items()}
+        if isinstance(node, list):
+            return [self.normalize(v, found) for v in node]
+        return node
+
+    def denormalize(self, node):
+        if node == TENANT_PLACEHOLDER:
+            return {"terms": {TENANT_KEYWORD_FIELD: self.tenants}}
+        if isinstance(node, dict):
+            return {k: self.denormalize(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [self.denormalize(v) for v in node]
+        return node
+
+    def es_search(self, index, query):
+        found = set()
+        shape = self.normalize(query, found)
+        if len(found) != 1 or len(self.tenants) < 2:
+            return self.api.es_search(index, query)
+        tenant = found.pop()
+
+        key = json.dumps([index, shape], sort_keys=True)
+        with self.lock:
+            shape_lock = self.shape_locks[key]
+        with shape_lock:
+            if key not in self.responses:
+                try:
+                    self.responses[key] = self.fan_out(index, shape)
+                except (KeyError, TypeError) as e:
+                    # Remembered as failed so the other tenants don't retry it
+                    print(f"Tenant fan-out failed on {index} ({e!r}), querying each tenant separately")
+                    self.responses[key] = None
+
+        if self.responses[key] is not None and tenant in self.responses[key]:
+            return self.responses[key][tenant]
+        # No documents for this tenant in the split, ask for it directly
+        return self.api.es_search(index, query)
+
+    def fan_out(self, index, shape):
+        """ Sends one query for all tenants and slices the response into per tenant responses """
+        query = self.denormalize(shape)
+        aggs = query.pop("aggs", {})
+        hits_size = query.get("size", 10)
+
+        tenant_aggs = dict(aggs)
+        if hits_size:
+            tenant_aggs["tenant_hits"] = {"top_hits": {"size": hits_size, "sort": query.pop("sort", [])}}
+        query["size"] = 0
+        query["aggs"] = {
+          "tenant": {
+            "terms": {
+              "field": TENANT_KEYWORD_FIELD,
+              "size": len(self.tenants)
+            },
+            "aggs": tenant_aggs
+          }
+        }
+
+        response = self.api.es_search(index, query)
+        if not isinstance(response, dict) or 'tenant' not in response.get('aggregations', {}):
+            raise KeyError("No tenant aggregation in the fan-out response")
+
+        tenant_responses = {}
+        for b in response['aggregations']['tenant']['buckets']:
+            tenant_response = {'aggregations': {k: v for k, v in b.items() if k in aggs}}
+            if hits_size:
+                tenant_response['hits'] = b['tenant_hits']['hits']
+            tenant_responses[b['key']] = tenant_response
+        return tenant_responses
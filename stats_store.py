@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+from collections.abc import Iterable
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from report_formats import to_json_value
+
+STATS_FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+# Scalar attributes of StellarCyberStats kept in the manifest
+MANIFEST_ATTRIBUTES = ('tenant', 'start', 'end', 'daily_date_scale', 'collector_timings', 'collector_errors')
+
+
+def is_number_list(value):
+    return (isinstance(value, list) and len(value) > 0
+            and all(isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_)) for v in value))
+
+
+class StatsEncoder():
+    """
+    Splits one collector result into a JSON skeleton plus Arrow columns for numeric
+    series and matrices and Parquet files for DataFrames.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.columns = {}
+        self.frames = {}
+
+    def encode(self, value, key_path=()):
+        if isinstance(value, Iterable) and not isinstance(value, (str, bytes, dict, list, pd.DataFrame, np.ndarray)):
+            # dict_keys, tuples, Series...: stored as the list they iterate as
+            value = list(value)
+        if isinstance(value, dict):
+            return {str(k): self.encode(v, key_path + (str(k),)) for k, v in value.items()}
+        if isinstance(value, pd.DataFrame):
+            file_name = f"{self.name}.{'.'.join(key_path)}.parquet"
+            self.frames[file_name] = value
+            return {"$parquet": file_name}
+        if isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+            column = "/".join(key_path)
+            self.columns[column] = pa.array(value.ravel())
+            return {"$arrow": column, "shape": list(value.shape)}
+        if is_number_list(value):
+            column = "/".join(key_path)
+            self.columns[column] = pa.array([float(v) if isinstance(v, float) else v for v in value])
+            return {"$arrow": column, "list": True}
+        if isinstance(value, list):
+            return [self.encode(v, key_path + (str(i),)) for i, v in enumerate(value)]
+        return value
+
+    def write(self, stats_dir):
+        if self.columns:
+            # One row, one list column per series: every series keeps its own length
+            table = pa.table({name: pa.array([array], type=pa.list_(array.type)) for name, array in self.columns.items()})
+            with pa.OSFile(os.path.join(stats_dir, f"{self.name}.arrow"), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        for file_name, df in self.frames.items():
+            df.to_parquet(os.path.join(stats_dir, file_name))
+
+
+def save_stats(sc_stats, stats_dir):
+    """ Writes sc_stats as manifest.json + one Arrow IPC file per collector + Parquet frames """
+    tmp_dir = f"{stats_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {
+        'version': STATS_FORMAT_VERSION,
+        'query_timestamp': sc_stats.query_timestamp.isoformat(),
+        'attributes': {},
+    }
+    for name in MANIFEST_ATTRIBUTES:
+        manifest[name] = getattr(sc_stats, name, None)
+    for name in sc_stats.stats_attributes:
+        if name in MANIFEST_ATTRIBUTES:
+            continue
+        encoder = StatsEncoder(name)
+        manifest['attributes'][name] = encoder.encode(getattr(sc_stats, name, None))
+        encoder.write(tmp_dir)
+
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, default=to_json_value)
+
+    shutil.rmtree(stats_dir, ignore_errors=True)
+    os.rename(tmp_dir, stats_dir)
+
+
+class StatsStore():
+    """ Reads collector results back from a save_stats folder, Arrow files are memory mapped """
+
+    def __init__(self, stats_dir):
+        self.stats_dir = stats_dir
+        with open(os.path.join(stats_dir, MANIFEST), "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != STATS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported stats format version {self.manifest.get('version')} in {stats_dir}")
+
+    @staticmethod
+    def exists(stats_dir):
+        return os.path.exists(os.path.join(stats_dir, MANIFEST))
+
+    def attribute_names(self):
+        return list(self.manifest['attributes'])
+
+    def load(self, name):
+        arrow_path = os.path.join(self.stats_dir, f"{name}.arrow")
+        table = pa.ipc.open_file(pa.memory_map(arrow_path, "r")).read_all() if os.path.exists(arrow_path) else None
+        return self.decode(self.manifest['attributes'][name], table)
+
+    def decode(self, value, table):
+        if isinstance(value, dict):
+            if "$arrow" in value:
+                values = table.column(value["$arrow"])[0].values
+                if value.get("list"):
+                    return values.to_pylist()
+                return values.to_numpy(zero_copy_only=False).reshape(value["shape"])
+            if "$parquet" in value:
+                return pd.read_parquet(os.path.join(self.stats_dir, value["$parquet"]))
+            return {k: self.decode(v, table) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.decode(v, table) for v in value]
+        return value
@@ -1,17 +1,33 @@
 import json
 import base64
+import random
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlencode
 import streamlit as st
 
 requests.packages.urllib3.disable_warnings()
 
+
+class JitteredRetry(Retry):
+    """ urllib3 Retry with full jitter on the exponential backoff, so parallel clients don't retry in lockstep """
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else 0
+
+
 class StellarCyberAPI():
 
     json_headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+    retry_status_codes = (429, 500, 502, 503, 504)
 
-    def __init__(self, url, username, api_key, deployment, org_id=""):
+    def __init__(self, url, username, api_key, deployment, org_id="", pool_size=10, max_retries=3, backoff_factor=0.5, cache=None, bucket_store=None):
         self.api_baseurl = f"{url}/connect/api"
+        self.cache = cache
+        self.bucket_store = bucket_store
+        self.session = self.gen_session(pool_size, max_retries, backoff_factor)
         self.headers = {
             'Accept': 'application/json', 
             'Content-Type': 'application/json',
@@ -20,6 +36,26 @@ class StellarCyberAPI():
         self.org_id = org_id
         self.tenant_info = []
 
+    def gen_session(self, pool_size, max_retries, backoff_factor):
+        """ Keep-alive session with a bounded connection pool, retrying transient 429/5xx errors """
+        retry = JitteredRetry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.retry_status_codes,
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.verify = False
+        return session
+
+    def close(self):
+        self.session.close()
+
     def getAccessToken(self, url, username, api_key):
         auth = base64.b64encode(bytes(username + ":" + api_key, "utf-8")).decode("utf-8")
         headers = {
@@ -27,7 +63,7 @@ class StellarCyberAPI():
             "Content-Type": "application/x-www-form-urlencoded",
         }
         req = url + "/connect/api/v1/access_token"
-        res = requests.post(req, headers=headers, verify=False)
+        res = self.session.post(req, headers=headers, verify=False)
         return res.json()["access_token"]
 
     def gen_auth(self, url, username, api_key, deployment):
@@ -44,16 +80,25 @@ class StellarCyberAPI():
 
     def es_search(self, index, query):
         api_url = f"{self.api_baseurl}/data/{index}/_search"
+        if self.cache:
+            cache_key = self.cache.key(self.api_baseurl, index, query)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print("es cache hit:", api_url)
+                return cached
         print("send es request:", api_url, "\n", json.dumps(query))
         try:
-            response = requests.get(
+            response = self.session.get(
                 api_url,
                 data = json.dumps(query),
                 headers = self.headers,
                 verify = False
             )
             if response and response.status_code == 200:
-                return response.json()
+                result = response.json()
+                if self.cache:
+                    self.cache.put(cache_key, result, query)
+                return result
             else:
                 st.error(f"ES query failed against url: {api_url}")
                 return {}
@@ -65,15 +110,24 @@ class StellarCyberAPI():
 
     def rest_search(self, route, params):
         api_url = f"{self.api_baseurl}/{route}?" + urlencode(params)
+        if self.cache:
+            cache_key = self.cache.key(self.api_baseurl, route, params)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print("rest cache hit:", api_url)
+                return cached
         print("send rest request:", api_url)
         try:
-            response = requests.get(
+            response = self.session.get(
                 api_url,
                 headers = self.headers,
                 verify=False
             )
             if response and response.status_code == 200:
-                return response.json()
+                result = response.json()
+                if self.cache:
+                    self.cache.put(cache_key, result, params)
+                return result
             else:
                 raise RuntimeError("ES query failed:", response, api_url, params)
         except Exception as e:
@@ -83,7 +137,7 @@ class StellarCyberAPI():
 
     def get_tenants(self):
         api_url = self.api_baseurl + "/v1/tenants"
-        response = requests.get(
+        response = self.session.get(
             api_url,
             headers=self.headers,
             verify=False,
@@ -91,4 +145,3 @@ class StellarCyberAPI():
         self.tenant_info = {i["cust_name"]: i for i in response["data"]}
         tenant_options = sorted([i["cust_name"] for i in response["data"]], key=str.lower)     
         return tenant_options
-
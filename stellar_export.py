@@ -0,0 +1,167 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import plotly
+import plotly.graph_objs as go
+import plotly.io as pio
+from query_cache import CACHE_DIR, DEFAULT_MAX_AGE, PRUNE_EVERY_PUTS, prune_cache_dir
+from utils import atomic_write
+
+# Disk space the figure cache may use, FIGURE_CACHE_MB overrides it
+DEFAULT_MAX_DISK_BYTES = int(os.environ.get("FIGURE_CACHE_MB", 1024)) * 1024 * 1024
+
+
+def warm_renderer():
+    """ Pool initializer, starts this worker's kaleido renderer before the first real figure """
+    try:
+        pio.to_image(go.Figure(), format="svg")
+    except Exception as e:
+        print("Unable to start kaleido:", e)
+
+
+def export_figure(figure_json, file_path, image_format="svg"):
+    """ Writes one figure given as plotly JSON, returns the time it took in seconds """
+    started = time.perf_counter()
+    pio.write_image(pio.from_json(figure_json, skip_invalid=True), file_path, format=image_format)
+    return time.perf_counter() - started
+
+
+class FigureExporter():
+    """
+    Exports plotly figures to image files across a pool of worker processes.
+    Each worker keeps its kaleido renderer running between figures, so one exporter
+    should be shared by every report of a batch.
+    """
+
+    def __init__(self, max_workers=None, image_format="svg"):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.image_format = image_format
+        self.executor = None
+        self.timings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.executor is None:
+            # spawn: kaleido and the streamlit runtime don't survive a fork
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_renderer
+            )
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def submit(self, figures, dst_folder):
+        """
+        Queues every figure of {name: figure or plotly JSON} for export into dst_folder,
+        returns {file path: future}
+        """
+        executor = self.start()
+        os.makedirs(dst_folder, exist_ok=True)
+        futures = {}
+        for figure_name, figure in figures.items():
+            file_path = f"{os.path.join(dst_folder, figure_name)}.{self.image_format}"
+            figure_json = figure if isinstance(figure, str) else figure.to_json()
+            futures[file_path] = executor.submit(export_figure, figure_json, file_path, self.image_format)
+        return futures
+
+    def wait(self, futures):
+        """ Waits for submitted exports, returns {file path: seconds} and records them in timings """
+        timings = {file_path: future.result() for file_path, future in futures.items()}
+        self.timings.update(timings)
+        for file_path, seconds in timings.items():
+            print(f"Exported {os.path.basename(file_path)} in {seconds:.2f}s")
+        return timings
+
+    def export(self, figures, dst_folder):
+        return self.wait(self.submit(figures, dst_folder))
+
+    def export_many(self, jobs):
+        """ Exports several reports' figures at once, jobs is a list of ({name: figure}, dst_folder) """
+        futures = {}
+        for figures, dst_folder in jobs:
+            futures.update(self.submit(figures, dst_folder))
+        return self.wait(futures)
+
+
+class FigureCache():
+    """
+    Exported figure files keyed by a hash of the figure JSON (data + layout) and format.
+    A hit hard links (or copies) the stored file instead of rendering it again.
+    Pruned like QueryCache: files unused for max_age, then least recently used down to max_disk_bytes.
+    """
+
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, "figures"), max_disk_bytes=DEFAULT_MAX_DISK_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.stores = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.prune()
+
+    @staticmethod
+    def key(figure_json, image_format="svg"):
+        digest = hashlib.sha256(f"{plotly.__version__}:{image_format}:".encode("utf-8"))
+        digest.update(figure_json.encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key, image_format="svg"):
+        return os.path.join(self.cache_dir, key[0:2], f"{key}.{image_format}")
+
+    def fetch(self, key, file_path, image_format="svg"):
+        """ Places the cached file at file_path, False on a miss """
+        cached_path = self.path(key, image_format)
+        if not os.path.exists(cached_path):
+            return False
+        remove_file(file_path)
+        try:
+            os.link(cached_path, file_path)
+        except OSError:
+            try:
+                shutil.copy2(cached_path, file_path)
+            except FileNotFoundError:
+                # Pruned in the meantime
+                return False
+        # The file's mtime is its last use for pruning
+        os.utime(file_path)
+        return True
+
+    def store(self, key, file_path, image_format="svg"):
+        # A copy, not a link: the report's file may be rewritten later
+        cached_path = self.path(key, image_format)
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        with open(file_path, "rb") as f:
+            atomic_write(cached_path, f.read(), "wb")
+
+        with self.lock:
+            self.stores += 1
+            due = self.stores % PRUNE_EVERY_PUTS == 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        removed, total = prune_cache_dir(self.cache_dir, self.max_disk_bytes, self.max_age)
+        if removed:
+            print(f"Pruned {removed} cached figures, {total / 1024 / 1024:.1f} MB left")
+
+
+def remove_file(file_path):
+    """ Unlinks before writing so a hard linked cache entry is never written through """
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
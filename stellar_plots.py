@@ -1,34 +1,179 @@
 import os
+import time
+from contextlib import nullcontext
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 import plotly.express as px
+from stellar_export import remove_file
+from stellar_svg import SvgChart
+
+
+FIGURE_NAMES = (
+    "incident_line_graph",
+    "alert_line_graph",
+    "stage_heatmap",
+    "tactic_heatmap",
+    "alert_map",
+    "volume_assets_line_graph",
+    "volume_category_trends",
+    "top_data_sources_volume",
+    "all_data_sources_volume_sankey",
+    "volume_pie_chart"
+)
+
+# Stats of the data source breakdown behind combine_data_sources and daily_category_volume_gb
+DATA_SOURCE_STATS = (
+    "connector_stats", "log_source_stats", "linux_sensor_stats",
+    "windows_sensor_stats", "network_sensor_stats", "security_sensor_stats"
+)
+
+# Collector results each figure is built from, a figure can be shown once all of them are in
+FIGURE_INPUTS = {
+    "incident_line_graph": ("incident_stats",),
+    "alert_line_graph": ("alert_stats",),
+    "stage_heatmap": ("alert_stage_stats",),
+    "tactic_heatmap": ("alert_tactic_stats",),
+    "alert_map": ("alert_geo_stats",),
+    "volume_assets_line_graph": ("volume_stats", "asset_stats"),
+    "volume_category_trends": DATA_SOURCE_STATS,
+    "top_data_sources_volume": DATA_SOURCE_STATS,
+    "all_data_sources_volume_sankey": DATA_SOURCE_STATS,
+    "volume_pie_chart": DATA_SOURCE_STATS,
+}
+
+# Figures the "native" renderer writes as SVG directly instead of through kaleido
+NATIVE_FIGURES = (
+    "incident_line_graph",
+    "alert_line_graph",
+    "volume_category_trends",
+    "top_data_sources_volume"
+)
 
 
 class StellarCyberPlots():
 
-    def __init__(self, sc_stats):
+    def __init__(self, sc_stats, renderer="plotly", lock=None):
         self.sc_stats = sc_stats
-        self.figures = {p:self.get_figure(p) for p in [
-            "incident_line_graph",
-            "alert_line_graph",
-            "stage_heatmap",
-            "tactic_heatmap",
-            "alert_map",
-            "volume_assets_line_graph",
-            "volume_category_trends",
-            "top_data_sources_volume",
-            "all_data_sources_volume_sankey",
-            "volume_pie_chart"
-        ]}
-    
-    def save_figures(self, dst_folder):
+        self.renderer = renderer  # "plotly" or "native" for the NATIVE_FIGURES in exported reports
+        self._figures = {}  # Built on first use by get_figure
+        self.lock = lock  # Held while building when the plots are shared between threads
+        self.on_build = None  # Called with (fig_name, figure) once a figure is built
+        self.export_timings = {}
+
+    @property
+    def figures(self):
+        return {p:self.get_figure(p) for p in FIGURE_NAMES}
+
+    def save_figures(self, dst_folder, exporter=None, cache=None, optimizer=None):
+        """
+        Writes every figure as an SVG into dst_folder, through a FigureExporter's process pool if given.
+        With a FigureCache, figures whose data and layout were exported before are linked from it instead.
+        With renderer="native" the NATIVE_FIGURES are written by stellar_svg without kaleido.
+        An SvgOptimizer then minifies (or rasterizes) every written file.
+        Returns and keeps in export_timings the seconds spent on each file.
+        """
+        save_figures_many([(self, dst_folder)], exporter=exporter, cache=cache, optimizer=optimizer)
+        return self.export_timings
+
+    def prepare_export(self, dst_folder, cache=None):
+        """
+        Writes the native and cached figures, returns ({name: figure JSON} still to export, cache keys by file path)
+        """
         os.makedirs(dst_folder, exist_ok=True)
-        for figure_name, figure in self.figures.items():
-          figure.write_image(f"{os.path.join(dst_folder, figure_name)}.svg")
+        self.export_timings = {}
+
+        pending = {}
+        cache_keys = {}
+        for figure_name in FIGURE_NAMES:
+          file_path = f"{os.path.join(dst_folder, figure_name)}.svg"
+          if self.renderer == "native" and figure_name in NATIVE_FIGURES:
+            started = time.perf_counter()
+            remove_file(file_path)
+            with open(file_path, "w") as f:
+              f.write(self.native_svg(figure_name))
+            self.export_timings[file_path] = time.perf_counter() - started
+            continue
+
+          figure_json = self.get_figure(figure_name).to_json()
+          if cache is not None:
+            started = time.perf_counter()
+            cache_keys[file_path] = cache.key(figure_json)
+            if cache.fetch(cache_keys[file_path], file_path):
+              self.export_timings[file_path] = time.perf_counter() - started
+              continue
+          remove_file(file_path)
+          pending[figure_name] = figure_json
+        return pending, cache_keys
+
+    def export_in_process(self, pending, dst_folder):
+        for figure_name in pending:
+          file_path = f"{os.path.join(dst_folder, figure_name)}.svg"
+          started = time.perf_counter()
+          self.get_figure(figure_name).write_image(file_path)
+          self.export_timings[file_path] = time.perf_counter() - started
+
+    def complete_export(self, dst_folder, pending, cache_keys, cache=None, optimizer=None):
+        """ Stores the freshly exported files in the cache and optimizes every file """
+        if cache is not None:
+          for figure_name in pending:
+            file_path = f"{os.path.join(dst_folder, figure_name)}.svg"
+            cache.store(cache_keys[file_path], file_path)
+
+        if optimizer is not None:
+          for figure_name in FIGURE_NAMES:
+            file_path = f"{os.path.join(dst_folder, figure_name)}.svg"
+            optimizer.optimize(file_path, None if figure_name in NATIVE_FIGURES and self.renderer == "native" else self.get_figure(figure_name))
 
     def get_figure(self, fig_name):
+      """ Figure by name, built once per StellarCyberPlots and reused afterwards """
+      if fig_name not in self._figures:
+        with self.lock or nullcontext():
+          if fig_name not in self._figures:
+            figure = self.build_figure(fig_name)
+            self._figures[fig_name] = figure
+            if self.on_build is not None:
+              self.on_build(fig_name, figure)
+      return self._figures[fig_name]
+
+    def native_svg(self, fig_name):
+      """ SVG markup for one of the NATIVE_FIGURES, same data and styling as its plotly figure """
+      sc_stats = self.sc_stats
+      days = sc_stats.daily_date_scale
+
+      if fig_name == "incident_line_graph":
+        critical_count_per_day = sc_stats.incident_stats['critical_count_per_day']
+        chart = SvgChart(critical_count_per_day['date'], [('Critical Incidents', critical_count_per_day['count'], "rgb(217,72,1)")],
+                         height=300, x_title='Date', y_title='Count')
+        return chart.line_chart()
+
+      elif fig_name == "alert_line_graph":
+        alert_stats = sc_stats.alert_stats
+        chart = SvgChart(days, [
+            ('Critical Alerts', alert_stats['critical_count_per_day']['count'], "rgb(217,72,1)"),
+            ('High Fidelity Alerts', alert_stats['high_fidelity_count_per_day']['count'], "#EAAA00")
+          ], height=280, x_title='Date', y_title='Count')
+        return chart.line_chart()
+
+      elif fig_name == "volume_category_trends":
+        category_volume = sc_stats.daily_category_volume_gb()
+        chart = SvgChart(days, [
+            ('Sensors', category_volume['Sensors'], '#1a76ff'),
+            ('Connectors', category_volume['Connectors'], '#00c698'),
+            ('Logs', category_volume['Logs'], '#bc5090')
+          ], height=280, x_title='Date', y_title='Data Volume (GB)', top=40)
+        return chart.bar_chart(stacked=True)
+
+      elif fig_name == "top_data_sources_volume":
+        categories_sorted, data_sources_sorted, volume_sorted = sc_stats.combine_data_sources()
+        chart = SvgChart(data_sources_sorted[0:10], [('Data Volume', volume_sorted[0:10], '#1a76ff')],
+                         height=300, x_title='Data Source', y_title='Data Volume (GB)', date_axis=False, rotate_labels=True)
+        return chart.bar_chart()
+
+      raise ValueError(f"No native renderer for {fig_name}")
+
+    def build_figure(self, fig_name):
       sc_stats = self.sc_stats
       daily_date_scale = sc_stats.daily_date_scale
 
@@ -95,8 +240,7 @@ class StellarCyberPlots():
 
       elif fig_name == "stage_heatmap":
         alert_stage_stats = sc_stats.alert_stage_stats
-        stages = alert_stage_stats['daily_high_fidelity_count_by_stage']['stage']
-        stages.reverse()
+        stages = alert_stage_stats['daily_high_fidelity_count_by_stage']['stage'][::-1]
 
         fig = go.Figure(data=go.Heatmap(
                 z=np.flip(alert_stage_stats['daily_high_fidelity_count_by_stage']['count_matrix'], 0),
@@ -160,9 +304,8 @@ class StellarCyberPlots():
 
       elif fig_name == "volume_assets_line_graph":
         days = daily_date_scale
-        volume_stats = sc_stats.volume_stats
         asset_stats = sc_stats.asset_stats
-        volume = np.array(volume_stats['volume_per_day']['volume']) / 1000 / 1000 / 1000  # Get value in GB
+        volume = sc_stats.daily_volume_gb()
         assets = asset_stats['assets_per_day']['count']
   
         fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -233,15 +376,10 @@ class StellarCyberPlots():
  
       elif fig_name == "volume_category_trends":
         days = daily_date_scale
-        connectors = np.array(sc_stats.connector_stats['volume_per_day']['volume']) / 1000 / 1000 / 1000  # Get value in GB
-        logs = np.array(sc_stats.log_source_stats['volume_per_day']['volume']) / 1000 / 1000 / 1000  # Get value in GB
-
-        # Combine all sensors together
-        sensors = np.array(sc_stats.linux_sensor_stats['volume_per_day']['volume']) + \
-          np.array(sc_stats.windows_sensor_stats['volume_per_day']['volume']) + \
-          np.array(sc_stats.network_sensor_stats['volume_per_day']['volume']) + \
-          np.array(sc_stats.security_sensor_stats['volume_per_day']['volume'])
-        sensors = sensors / 1000 / 1000 / 1000  # Get value in GB
+        category_volume = sc_stats.daily_category_volume_gb()
+        sensors = category_volume['Sensors']
+        connectors = category_volume['Connectors']
+        logs = category_volume['Logs']
 
         fig = go.Figure(data=[
             go.Bar(name='Sensors', x=days, y=sensors, marker_color='#1a76ff'),
@@ -310,16 +448,10 @@ class StellarCyberPlots():
         volume_sorted = volume_sorted[0:20]
 
         # Get connector, log source, sensor totals
-        sensor_total = 0
-        connector_total = 0
-        log_source_total = 0
-        for i in range(0, len(categories_sorted)):
-          if categories_sorted[i] == 'Sensor':
-            sensor_total += volume_sorted[i]
-          elif categories_sorted[i] == 'Connector':
-            connector_total += volume_sorted[i]
-          elif categories_sorted[i] == 'Log Source':
-            log_source_total += volume_sorted[i]
+        totals = sc_stats.category_volume_totals(20)
+        sensor_total = totals['Sensor']
+        connector_total = totals['Connector']
+        log_source_total = totals['Log Source']
 
         data_source_labels = ['Sensor', 'Connector', 'Log Source'] + list(data_sources_sorted)
         data_source_parents = ['', '', ''] + list(categories_sorted)
@@ -374,4 +506,23 @@ class StellarCyberPlots():
                 },
           )
 
-      return fig
\ No newline at end of file
+      return fig
+
+
+def save_figures_many(jobs, exporter=None, cache=None, optimizer=None):
+    """
+    save_figures for several reports, jobs is a list of (StellarCyberPlots, dst_folder).
+    The figures every report still needs go to the exporter's pool in one batch.
+    """
+    prepared = [(sc_plots, dst_folder) + sc_plots.prepare_export(dst_folder, cache) for sc_plots, dst_folder in jobs]
+
+    if exporter is not None:
+        timings = exporter.export_many([(pending, dst_folder) for _, dst_folder, pending, _ in prepared if pending])
+        for sc_plots, dst_folder, pending, _ in prepared:
+            sc_plots.export_timings.update({f: t for f, t in timings.items() if os.path.dirname(f) == dst_folder})
+    else:
+        for sc_plots, dst_folder, pending, _ in prepared:
+            sc_plots.export_in_process(pending, dst_folder)
+
+    for sc_plots, dst_folder, pending, cache_keys in prepared:
+        sc_plots.complete_export(dst_folder, pending, cache_keys, cache=cache, optimizer=optimizer)
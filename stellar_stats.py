@@ -1,4 +1,9 @@
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+import threading
+import time
 import numpy as np
 import pandas as pd
 from stats.volume_stats import volume_stats
@@ -14,14 +19,30 @@ from stats.alert_stage_stats import alert_stage_stats
 from stats.alert_tactic_stats import alert_tactic_stats
 from stats.alert_geo_stats import alert_geo_stats
 from stats.top_assets_stats import top_assets_stats
-from stats.incident_stats import get_incident_stats
+from stats.incident_stats import CASES_MAX_IN_FLIGHT, get_incident_stats
+from stats.ade_stats import ade_stats, ADE_SOURCES
+from stats.tenant_fanout import TenantFanoutAPI
+from stats_store import MANIFEST_ATTRIBUTES, StatsStore, save_stats
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import traceback
 
 
 class StellarCyberStats():
 
-    def __init__(self, api, tenant, start_date, end_date, org_id):
+    # Collectors producing several stats attributes at once, result is a dict keyed by attribute
+    grouped_collectors = {'ade_stats': tuple(ADE_SOURCES)}
+
+    # Attributes holding collector results, setting any of them drops the derived data
+    stats_attributes = (
+        'volume_stats', 'asset_stats', 'connector_stats', 'log_source_stats',
+        'linux_sensor_stats', 'windows_sensor_stats', 'network_sensor_stats', 'security_sensor_stats',
+        'alert_stats', 'alert_stage_stats', 'alert_tactic_stats', 'alert_geo_stats',
+        'top_assets_stats', 'incident_stats', 'daily_date_scale'
+    )
+
+    def __init__(self, api, tenant, start_date, end_date, org_id, parallel=False, max_workers=4, fused=False, on_result=None, should_stop=None,
+                 cases_in_flight=CASES_MAX_IN_FLIGHT):
         self.api = api
         self.daily_date_scale = list(pd.Series(pd.date_range(start_date, end_date, freq='D').strftime('%Y-%m-%d')))
         self.start = start_date
@@ -32,28 +53,130 @@ class StellarCyberStats():
         self.tenant = tenant
         
         self.query_timestamp = datetime.now()
+        self.collector_timings = {}
+        self.collector_errors = {}
+        self.stopped = False
         try:
-            self.query_stats(tenant, start_date, end_date, org_id)
+            self.query_stats(tenant, start_date, end_date, org_id, parallel=parallel, max_workers=max_workers, fused=fused,
+                             on_result=on_result, should_stop=should_stop, cases_in_flight=cases_in_flight)
         except Exception as e:
             st.error("Unable to retrieve all statistics for this deployment.")
             print(e)
             print(traceback.format_exc())
 
-    def query_stats(self, tenant, start_date, end_date, org_id=None):
-        self.volume_stats = volume_stats(self.api, start_date, end_date, self.daily_date_scale, tenant, org_id)
-        self.asset_stats = asset_stats(self.api, start_date, end_date, self.daily_date_scale, tenant, org_id)
-        self.connector_stats = connector_stats(self.api, start_date, end_date, tenant, org_id)
-        self.log_source_stats = log_source_stats(self.api, start_date, end_date, tenant, org_id)
-        self.linux_sensor_stats = linux_sensor_stats(self.api, start_date, end_date, tenant, org_id)
-        self.windows_sensor_stats = windows_sensor_stats(self.api, start_date, end_date, tenant, org_id)
-        self.network_sensor_stats = network_sensor_stats(self.api, start_date, end_date, tenant, org_id)
-        self.security_sensor_stats = security_sensor_stats(self.api, start_date, end_date, tenant, org_id)
-        self.alert_stats = alert_stats(self.api, start_date, end_date, tenant, org_id)
-        self.alert_stage_stats = alert_stage_stats(self.api, start_date, end_date, tenant, org_id)
-        self.alert_tactic_stats = alert_tactic_stats(self.api, start_date, end_date, tenant, org_id)
-        self.alert_geo_stats = alert_geo_stats(self.api, start_date, end_date, tenant, org_id)
-        self.top_assets_stats = top_assets_stats(self.api, start_date, end_date, tenant, org_id)
-        self.incident_stats = get_incident_stats(self.api, self.daily_date_scale, tenant)
+    @classmethod
+    def for_tenants(cls, api, tenants, start_date, end_date, org_id, **kwargs):
+        """
+        Stats for several tenants keyed by tenant name. ES queries that only differ by
+        tenant are sent once with a tenant_name split and shared between the tenants.
+        """
+        fanout_api = TenantFanoutAPI(api, tenants)
+        tenant_stats = {}
+        for tenant in tenants:
+            sc_stats = cls(fanout_api, tenant, start_date, end_date, org_id, **kwargs)
+            sc_stats.api = api
+            tenant_stats[tenant] = sc_stats
+        return tenant_stats
+
+    def collectors(self, tenant, start_date, end_date, org_id=None, fused=False, cases_in_flight=CASES_MAX_IN_FLIGHT):
+        """
+        Maps each stats attribute to the collector call that produces it.
+        With fused=True the aella-ade-* collectors are replaced by the single ade_stats query.
+        cases_in_flight is the number of time slices the cases are streamed in concurrently.
+        """
+        api = self.api
+        collectors = {
+            'volume_stats': partial(volume_stats, api, start_date, end_date, self.daily_date_scale, tenant, org_id),
+            'asset_stats': partial(asset_stats, api, start_date, end_date, self.daily_date_scale, tenant, org_id),
+            'connector_stats': partial(connector_stats, api, start_date, end_date, tenant, org_id),
+            'log_source_stats': partial(log_source_stats, api, start_date, end_date, tenant, org_id),
+            'linux_sensor_stats': partial(linux_sensor_stats, api, start_date, end_date, tenant, org_id),
+            'windows_sensor_stats': partial(windows_sensor_stats, api, start_date, end_date, tenant, org_id),
+            'network_sensor_stats': partial(network_sensor_stats, api, start_date, end_date, tenant, org_id),
+            'security_sensor_stats': partial(security_sensor_stats, api, start_date, end_date, tenant, org_id),
+            'alert_stats': partial(alert_stats, api, start_date, end_date, tenant, org_id),
+            'alert_stage_stats': partial(alert_stage_stats, api, start_date, end_date, tenant, org_id),
+            'alert_tactic_stats': partial(alert_tactic_stats, api, start_date, end_date, tenant, org_id),
+            'alert_geo_stats': partial(alert_geo_stats, api, start_date, end_date, tenant, org_id),
+            'top_assets_stats': partial(top_assets_stats, api, start_date, end_date, tenant, org_id),
+            'incident_stats': partial(get_incident_stats, api, self.daily_date_scale, tenant, max_in_flight=cases_in_flight),
+        }
+
+        if fused:
+            for name in self.grouped_collectors['ade_stats']:
+                del collectors[name]
+            collectors['ade_stats'] = partial(ade_stats, api, start_date, end_date, tenant, org_id)
+
+        return collectors
+
+    def query_stats(self, tenant, start_date, end_date, org_id=None, parallel=False, max_workers=4, fused=False, on_result=None, should_stop=None,
+                    cases_in_flight=CASES_MAX_IN_FLIGHT):
+        """
+        Runs every collector and stores its result under the matching attribute.
+        A failing collector is recorded in collector_errors and its attribute set to None,
+        the remaining collectors still run.
+        With on_result each result is stored as soon as its collector finishes and
+        on_result(self, attribute_names) is called, so pages can show it straight away.
+        Once should_stop() returns True the collectors not started yet are skipped and stopped is set.
+        """
+        collectors = self.collectors(tenant, start_date, end_date, org_id, fused=fused, cases_in_flight=cases_in_flight)
+
+        if parallel:
+            # Streamlit calls (st.error) from worker threads need the script run context
+            ctx = get_script_run_ctx()
+            with ThreadPoolExecutor(max_workers=max_workers,
+                                    initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as executor:
+                futures = {name: executor.submit(self.collect, name, fn, on_result, should_stop) for name, fn in collectors.items()}
+                results = {name: future.result() for name, future in futures.items()}
+        else:
+            results = {name: self.collect(name, fn, on_result, should_stop) for name, fn in collectors.items()}
+
+        # Published results are already set, otherwise assign in declaration order so the attribute layout matches the sequential mode
+        if on_result is None:
+            for name in collectors:
+                self.store_result(name, results[name])
+
+        if self.collector_errors:
+            st.error(f"Unable to retrieve: {', '.join(self.collector_errors.keys())}")
+
+    def store_result(self, name, result):
+        """ Sets the attribute(s) a collector produces, returns their names """
+        if name in self.grouped_collectors:
+            for attr in self.grouped_collectors[name]:
+                setattr(self, attr, (result or {}).get(attr))
+            return self.grouped_collectors[name]
+        setattr(self, name, result)
+        return (name,)
+
+    def collect(self, name, fn, on_result=None, should_stop=None):
+        """ run_collector, then with on_result the result is stored and published right away """
+        if self.stopped or (should_stop is not None and should_stop()):
+            self.stopped = True
+            return None
+        result = self.run_collector(name, fn)
+        if on_result is not None:
+            attribute_names = self.store_result(name, result)
+            try:
+                on_result(self, attribute_names)
+            except Exception as e:
+                # Publishing is best effort, it must not abort the collector run
+                print(f"Publishing {name} failed:", e)
+                print(traceback.format_exc())
+        return result
+
+    def run_collector(self, name, fn):
+        """ Runs a single collector, recording its duration and any failure """
+        started = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            self.collector_errors[name] = repr(e)
+            print(f"Collector {name} failed:", e)
+            print(traceback.format_exc())
+            return None
+        finally:
+            self.collector_timings[name] = time.perf_counter() - started
+            print(f"Collector {name} finished in {self.collector_timings[name]:.2f}s")
 
     def list_stats(self):
         return {
@@ -73,9 +196,69 @@ class StellarCyberStats():
             "Incident Stats": self.incident_stats
         }
     
+    def __setattr__(self, name, value):
+        # Replacing any collected stats makes the derived data stale
+        if name in self.stats_attributes:
+            self.__dict__.pop('_derived', None)
+        super().__setattr__(name, value)
+
+    def __getstate__(self):
+        # A lazily loaded object is pickled with everything loaded
+        if '_store' in self.__dict__:
+            for name in self._store.attribute_names():
+                getattr(self, name)
+        state = self.__dict__.copy()
+        state.pop('_derived', None)
+        state.pop('_store', None)
+        state.pop('_lock', None)
+        return state
+
+    def __getattr__(self, name):
+        # Only called for missing attributes: collector results of a loaded report are read on first use
+        store = self.__dict__.get('_store')
+        if store is None or name not in store.manifest['attributes']:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        with self.__dict__.get('_lock') or nullcontext():
+            if name not in self.__dict__:
+                self.__dict__[name] = store.load(name)  # Loading isn't a change, keep the derived data
+        return self.__dict__[name]
+
+    def save(self, stats_dir):
+        """ Persists the stats as Arrow/Parquet columns plus a JSON manifest, see stats_store """
+        save_stats(self, stats_dir)
+
+    @classmethod
+    def load(cls, stats_dir):
+        """ Stats saved by save(), each collector's result is only read when first accessed """
+        store = StatsStore(stats_dir)
+        sc_stats = cls.__new__(cls)
+        sc_stats.__dict__['_store'] = store
+        for name in MANIFEST_ATTRIBUTES:
+            sc_stats.__dict__[name] = store.manifest.get(name)
+        sc_stats.query_timestamp = datetime.fromisoformat(store.manifest['query_timestamp'])
+        return sc_stats
+
+    def share(self, lock):
+        """ Lazy loading and derived data are computed under lock, for stats used by several threads """
+        self.__dict__['_lock'] = lock
+
+    def derived(self, key, compute):
+        """ Computes a value derived from the stats once per stats object """
+        cache = self.__dict__.setdefault('_derived', {})
+        if key not in cache:
+            with self.__dict__.get('_lock') or nullcontext():
+                if key not in cache:
+                    cache[key] = compute()
+        return cache[key]
+
+    def invalidate_derived(self):
+        self.__dict__.pop('_derived', None)
+
     def combine_data_sources(self):
         """ Combines all unique data sources into sorted lists by volume with categories """
+        return self.derived('combine_data_sources', self._combine_data_sources)
 
+    def _combine_data_sources(self):
         # Merge all data sources into a single dict
         categories = ['Connector'] * len(self.connector_stats['cumulative_volume_by_connector']['connector_name']) + \
         ['Log Source'] * len(self.log_source_stats['cumulative_volume_by_log_source']['log_source']) + \
@@ -100,5 +283,36 @@ class StellarCyberStats():
         data_sources_sorted = data_sources[sort_inds]
         volume_sorted = volume[sort_inds]
 
+        # Shared between every caller, keep them read only
+        for a in (categories_sorted, data_sources_sorted, volume_sorted):
+            a.setflags(write=False)
+
         return categories_sorted, data_sources_sorted, volume_sorted
 
+    def category_volume_totals(self, top=20):
+        """ Total GB per category ('Sensor', 'Connector', 'Log Source') over the top data sources by volume """
+        def compute():
+            categories_sorted, _, volume_sorted = self.combine_data_sources()
+            totals = {'Sensor': 0, 'Connector': 0, 'Log Source': 0}
+            for category, volume in zip(categories_sorted[0:top], volume_sorted[0:top]):
+                totals[category] += volume
+            return totals
+        return self.derived(('category_volume_totals', top), compute)
+
+    def daily_volume_gb(self):
+        """ Total ingested volume per day in GB """
+        return self.derived('daily_volume_gb', lambda: np.array(self.volume_stats['volume_per_day']['volume']) / 1000 / 1000 / 1000)
+
+    def daily_category_volume_gb(self):
+        """ Volume per day in GB for sensors (all sensor types combined), connectors and log sources """
+        def compute():
+            sensors = np.array(self.linux_sensor_stats['volume_per_day']['volume']) + \
+              np.array(self.windows_sensor_stats['volume_per_day']['volume']) + \
+              np.array(self.network_sensor_stats['volume_per_day']['volume']) + \
+              np.array(self.security_sensor_stats['volume_per_day']['volume'])
+            return {
+                'Sensors': sensors / 1000 / 1000 / 1000,
+                'Connectors': np.array(self.connector_stats['volume_per_day']['volume']) / 1000 / 1000 / 1000,
+                'Logs': np.array(self.log_source_stats['volume_per_day']['volume']) / 1000 / 1000 / 1000,
+            }
+        return self.derived('daily_category_volume_gb', compute)
@@ -0,0 +1,150 @@
+import math
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+# Matches the layout the plotly versions of these charts use
+FONT_FAMILY = "Lato"
+FONT_COLOR = "#707070"
+FONT_SIZE = 12
+TITLE_FONT_SIZE = 16
+AXIS_COLOR = "#444444"
+LEGEND_WIDTH = 150
+MAX_X_LABELS = 8
+
+
+def nice_ticks(max_value, count=5):
+    """ Evenly spaced round tick values from 0 covering max_value """
+    if max_value <= 0:
+        return [0, 1]
+    raw_step = max_value / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw_step)
+    ticks = [0]
+    while ticks[-1] < max_value:
+        ticks.append(round(ticks[-1] + step, 10))
+    return ticks
+
+
+def format_tick(value):
+    """ Short tick label, SI suffixes from a thousand up like plotly """
+    for suffix, factor in (("G", 1e9), ("M", 1e6), ("k", 1e3)):
+        if abs(value) >= factor:
+            return f"{value / factor:g}{suffix}"
+    return f"{value:g}"
+
+
+def format_date_label(value):
+    try:
+        d = datetime.strptime(str(value)[0:10], "%Y-%m-%d")
+        return f"{d:%b} {d.day}"
+    except ValueError:
+        return str(value)
+
+
+def text(x, y, value, size=FONT_SIZE, anchor="middle", rotate=None, color=FONT_COLOR):
+    transform = f' transform="rotate({rotate} {x:.1f} {y:.1f})"' if rotate is not None else ""
+    return (f'<text x="{x:.1f}" y="{y:.1f}" font-family="{FONT_FAMILY}" font-size="{size}" fill="{color}" '
+            f'text-anchor="{anchor}"{transform}>{escape(str(value))}</text>')
+
+
+class SvgChart():
+    """
+    Minimal SVG chart over a category x axis (dates or names) and a linear y axis from 0,
+    for line and bar charts that don't need a plotly round trip through kaleido.
+    series is a list of (name, values, color), a legend is drawn when there's more than one.
+    """
+
+    def __init__(self, x_labels, series, width=630, height=300, x_title="", y_title="", top=0,
+                 date_axis=True, rotate_labels=False):
+        self.x_labels = [format_date_label(x) if date_axis else str(x) for x in x_labels]
+        self.series = [(name, [float(v or 0) for v in values], color) for name, values, color in series]
+        self.width = width
+        self.height = height
+        self.x_title = x_title
+        self.y_title = y_title
+        self.rotate_labels = rotate_labels
+
+        self.left = 70
+        self.right = self.width - (LEGEND_WIDTH if len(self.series) > 1 else 10)
+        self.top = top + 10
+        self.bottom = self.height - (110 if rotate_labels else 60)
+
+    def y_scale(self, ticks):
+        span = ticks[-1] - ticks[0] or 1
+        return lambda v: self.bottom - (v - ticks[0]) / span * (self.bottom - self.top)
+
+    def x_positions(self, centered):
+        n = max(len(self.x_labels), 1)
+        if centered:
+            step = (self.right - self.left) / n
+            return [self.left + step * (i + 0.5) for i in range(n)], step
+        step = (self.right - self.left) / max(n - 1, 1)
+        return [self.left + step * i for i in range(n)], step
+
+    def axes(self, ticks, y, xs):
+        parts = []
+        for tick in ticks:
+            parts.append(text(self.left - 6, y(tick) + 4, format_tick(tick), anchor="end"))
+        parts.append(f'<line x1="{self.left}" y1="{self.bottom}" x2="{self.right}" y2="{self.bottom}" stroke="{AXIS_COLOR}" stroke-width="1"/>')
+
+        label_every = 1 if self.rotate_labels else max(1, math.ceil(len(self.x_labels) / MAX_X_LABELS))
+        for i, (x, label) in enumerate(zip(xs, self.x_labels)):
+            if i % label_every:
+                continue
+            if self.rotate_labels:
+                parts.append(text(x, self.bottom + 14, label, anchor="end", rotate=-30))
+            else:
+                parts.append(text(x, self.bottom + 18, label))
+
+        parts.append(text((self.left + self.right) / 2, self.height - 8, self.x_title, size=TITLE_FONT_SIZE))
+        y_mid = (self.top + self.bottom) / 2
+        parts.append(text(16, y_mid, self.y_title, size=TITLE_FONT_SIZE, rotate=-90))
+        return parts
+
+    def legend(self):
+        if len(self.series) < 2:
+            return []
+        parts = []
+        for i, (name, _, color) in enumerate(self.series):
+            y = self.top + 10 + i * 20
+            parts.append(f'<line x1="{self.right + 15}" y1="{y}" x2="{self.right + 35}" y2="{y}" stroke="{color}" stroke-width="4"/>')
+            parts.append(text(self.right + 40, y + 4, name, anchor="start"))
+        return parts
+
+    def document(self, parts):
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+                f'viewBox="0 0 {self.width} {self.height}">' + "".join(parts) + "</svg>")
+
+    def line_chart(self):
+        ticks = nice_ticks(max((max(values, default=0) for _, values, _ in self.series), default=0))
+        y = self.y_scale(ticks)
+        xs, _ = self.x_positions(centered=False)
+
+        parts = self.axes(ticks, y, xs)
+        for _, values, color in self.series:
+            points = " ".join(f"{x:.1f},{y(v):.1f}" for x, v in zip(xs, values))
+            parts.append(f'<polyline points="{points}" fill="none" stroke="{color}" stroke-width="2" stroke-linejoin="round"/>')
+        return self.document(parts + self.legend())
+
+    def bar_chart(self, stacked=False):
+        n = len(self.x_labels)
+        if stacked:
+            totals = [sum(values[i] for _, values, _ in self.series) for i in range(n)]
+        else:
+            totals = [max(values[i] for _, values, _ in self.series) for i in range(n)]
+        ticks = nice_ticks(max(totals, default=0))
+        y = self.y_scale(ticks)
+        xs, step = self.x_positions(centered=True)
+        bar_width = step * 0.8
+
+        parts = self.axes(ticks, y, xs)
+        base = [0.0] * n
+        for _, values, color in self.series:
+            for i, (x, v) in enumerate(zip(xs, values)):
+                y0 = base[i] if stacked else 0
+                top, bottom = y(y0 + v), y(y0)
+                parts.append(f'<rect x="{x - bar_width / 2:.1f}" y="{top:.1f}" width="{bar_width:.1f}" '
+                             f'height="{max(bottom - top, 0):.1f}" fill="{color}"/>')
+                if stacked:
+                    base[i] += v
+        return self.document(parts + self.legend())
@@ -0,0 +1,165 @@
+import base64
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+import weasyprint
+from utils import atomic_write
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+ET.register_namespace("", SVG_NS)
+ET.register_namespace("xlink", XLINK_NS)
+
+# Geometry attributes whose numbers are rounded, styling values are left alone
+GEOMETRY_ATTRIBUTES = {"d", "points", "transform", "x", "y", "x1", "x2", "y1", "y2", "cx", "cy", "r", "width", "height"}
+NUMBER_RE = re.compile(r"-?\d*\.\d+(?:[eE][-+]?\d+)?")
+REFERENCE_RE = re.compile(r"url\(#([^)]+)\)|^#(.+)$")
+OPACITY_RE = re.compile(r"opacity\s*:\s*0?\.\d+")
+
+
+def count_nodes(root):
+    return sum(1 for _ in root.iter())
+
+
+def round_numbers(value, precision):
+    def replace(match):
+        rounded = f"{float(match.group(0)):.{precision}f}".rstrip("0").rstrip(".")
+        return "0" if rounded in ("-0", "") else rounded
+    return NUMBER_RE.sub(replace, value)
+
+
+def referenced_ids(root):
+    ids = set()
+    for element in root.iter():
+        for value in element.attrib.values():
+            for match in REFERENCE_RE.finditer(value):
+                ids.add(match.group(1) or match.group(2))
+    return ids
+
+
+def strip_unused_defs(root):
+    used = referenced_ids(root)
+    for defs in root.iter(f"{{{SVG_NS}}}defs"):
+        for child in list(defs):
+            if child.get("id") not in used:
+                defs.remove(child)
+
+
+def mergeable(path):
+    """ Paths drawn the same way can share one d attribute, translucent ones can't (overlaps would change) """
+    return (path.tag == f"{{{SVG_NS}}}path" and len(path) == 0 and not path.get("id")
+            and not OPACITY_RE.search(path.get("style", "")) and not path.get("opacity"))
+
+
+def merge_paths(root):
+    """ Joins runs of sibling paths that only differ by their d into a single path """
+    for parent in root.iter():
+        merged = []
+        for child in list(parent):
+            previous = merged[-1] if merged else None
+            if (previous is not None and mergeable(previous) and mergeable(child)
+                    and {k: v for k, v in previous.attrib.items() if k != "d"} == {k: v for k, v in child.attrib.items() if k != "d"}
+                    and not (previous.tail or "").strip()):
+                previous.set("d", f"{previous.get('d', '')} {child.get('d', '')}")
+                parent.remove(child)
+            else:
+                merged.append(child)
+
+
+def minify_svg(svg_text, precision=2):
+    """ Rounds coordinates, strips unused defs and merges paths, returns (svg text, nodes before, nodes after) """
+    root = ET.fromstring(svg_text)
+    nodes_before = count_nodes(root)
+
+    strip_unused_defs(root)
+    for element in root.iter():
+        for name, value in element.attrib.items():
+            if name in GEOMETRY_ATTRIBUTES:
+                element.set(name, round_numbers(value, precision))
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    merge_paths(root)
+
+    return ET.tostring(root, encoding="unicode"), nodes_before, count_nodes(root)
+
+
+def rasterized_svg(png_bytes, width, height):
+    """ An SVG wrapping a PNG, so templates keep referencing plots/<name>.svg """
+    data = base64.b64encode(png_bytes).decode("ascii")
+    return (f'<svg xmlns="{SVG_NS}" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<image width="{width}" height="{height}" href="data:image/png;base64,{data}"/></svg>')
+
+
+def weasyprint_seconds(svg_text):
+    """ Time WeasyPrint takes to lay out and draw a page holding only this SVG """
+    started = time.perf_counter()
+    data = base64.b64encode(svg_text.encode("utf-8")).decode("ascii")
+    weasyprint.HTML(string=f'<img src="data:image/svg+xml;base64,{data}">').write_pdf()
+    return time.perf_counter() - started
+
+
+class SvgOptimizer():
+    """
+    Post export stage for report figures. Every SVG is minified, figures listed in
+    rasterize (the alert_map choropleth and the Sankey are the usual candidates) are
+    replaced by a PNG at the given DPI. Per figure byte and node counts and the time the
+    optimization took go to metrics, with measure_render the WeasyPrint time of the figure
+    before and after as well, and the render time saved.
+    """
+
+    def __init__(self, precision=2, rasterize=(), dpi=150, measure_render=False):
+        self.precision = precision
+        self.rasterize = set(rasterize)
+        self.dpi = dpi
+        self.measure_render = measure_render
+        self.metrics = {}
+
+    def optimize(self, file_path, figure=None):
+        started = time.perf_counter()
+        with open(file_path, "r") as f:
+            svg_text = f.read()
+        figure_name = os.path.splitext(os.path.basename(file_path))[0]
+
+        if figure_name in self.rasterize and figure is not None:
+            width = figure.layout.width or 700
+            height = figure.layout.height or 450
+            png_bytes = figure.to_image(format="png", width=width, height=height, scale=self.dpi / 96)
+            optimized = rasterized_svg(png_bytes, width, height)
+            nodes_before, nodes_after = count_nodes(ET.fromstring(svg_text)), 2
+        else:
+            optimized, nodes_before, nodes_after = minify_svg(svg_text, self.precision)
+
+        # Replace rather than rewrite, the file may be hard linked from the figure cache
+        atomic_write(file_path, optimized)
+
+        self.metrics[file_path] = {
+            'bytes_before': len(svg_text.encode("utf-8")),
+            'bytes_after': len(optimized.encode("utf-8")),
+            'nodes_before': nodes_before,
+            'nodes_after': nodes_after,
+            'rasterized': figure_name in self.rasterize and figure is not None,
+            'optimize_seconds': time.perf_counter() - started,
+        }
+        m = self.metrics[file_path]
+        if self.measure_render:
+            m['render_seconds_before'] = weasyprint_seconds(svg_text)
+            m['render_seconds_after'] = weasyprint_seconds(optimized)
+            m['render_seconds_saved'] = m['render_seconds_before'] - m['render_seconds_after']
+        print(f"Optimized {figure_name}: {m['bytes_before']} -> {m['bytes_after']} bytes, "
+              f"{m['nodes_before']} -> {m['nodes_after']} nodes in {m['optimize_seconds']:.2f}s"
+              + (f", {m['render_seconds_saved']:.3f}s render time saved" if self.measure_render else ""))
+        return self.metrics[file_path]
+
+    def summary(self):
+        """ Totals over every optimized figure """
+        keys = ['bytes_before', 'bytes_after', 'nodes_before', 'nodes_after', 'optimize_seconds']
+        if self.measure_render:
+            keys += ['render_seconds_before', 'render_seconds_after', 'render_seconds_saved']
+        totals = dict.fromkeys(keys, 0)
+        for m in self.metrics.values():
+            for k in totals:
+                totals[k] += m[k]
+        return totals
@@ -0,0 +1,20 @@
+from datetime import datetime
+from types import SimpleNamespace
+from stats_store import StatsStore, save_stats
+
+
+def test_dict_keys_round_trip(tmp_path):
+    volume_data = {'2024-01-01': 1.5, '2024-01-02': 2.5}
+    sc_stats = SimpleNamespace(
+        tenant='Tenant', start='2024-01-01', end='2024-01-02', daily_date_scale=list(volume_data),
+        collector_timings={}, collector_errors={}, query_timestamp=datetime(2024, 1, 3),
+        stats_attributes=('volume_stats',),
+        volume_stats={'volume_per_day': {'date': volume_data.keys(), 'volume': list(volume_data.values())}},
+    )
+    stats_dir = str(tmp_path / "stats")
+
+    save_stats(sc_stats, stats_dir)
+
+    volume_stats = StatsStore(stats_dir).load('volume_stats')
+    assert volume_stats['volume_per_day']['date'] == ['2024-01-01', '2024-01-02']
+    assert volume_stats['volume_per_day']['volume'] == [1.5, 2.5]
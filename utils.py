@@ -1,3 +1,5 @@
+import os
+import threading
 import jinja2
 from numerize import numerize
 
@@ -12,3 +14,11 @@ def humansize(nbytes, decimals):
     return '%s %s' % (f, suffixes[i])
 
 
+def atomic_write(file_path, data, mode="w"):
+    """ Writes a temporary file and moves it over file_path, readers and hard links to the old file never see a partial write """
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+